@@ -1,4 +1,8 @@
-from typing import TypedDict
+import re
+from array import array
+from typing import TypedDict, Dict, Iterable, Iterator, List, Optional
+
+from .proto import Bounds, ElementInfo
 
 """
 Component Node in UI
@@ -10,7 +14,7 @@ class ComponentNode(TypedDict):
     blur: str
     bounds: str
     checkable: str
-    checked: str 
+    checked: str
     clickable: str
     description: str
     enabled: str
@@ -26,4 +30,176 @@ class ComponentNode(TypedDict):
     selected : str
     text : str
     type : str
-    zIndex : str
\ No newline at end of file
+    zIndex : str
+
+
+_BOUNDS_PATTERN = re.compile(r"\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]")
+
+
+class NodeStore:
+    """
+    Struct-of-arrays storage of the nodes of one layout dump.
+
+    String attributes are interned into one table and stored as indexes,
+    bounds as four integers per node, "true"/"false" attributes as bits,
+    and the tree as parent / first child / next sibling index arrays.
+    `ElementInfo`, `Bounds` and attribute dicts are only built on request.
+    """
+
+    # boolean attributes packed into `flags`, bit i is FLAGS[i]
+    FLAGS = ("checkable", "checked", "clickable", "enabled", "focused",
+             "longClickable", "scrollable", "selected")
+    HAS_BOUNDS = 1 << len(FLAGS)
+
+    def __init__(self):
+        self.strings: List[str] = [""]
+        self._string_ids: Dict[str, int] = {"": 0}
+        self.columns: Dict[str, array] = {}
+        self.bounds = array("i")
+        self.flags = array("H")
+        self.parents = array("i")
+        self.depths = array("i")
+        self.first_child = array("i")
+        self.next_sibling = array("i")
+        self._last_child = array("i")
+        self._elements: Dict[int, ElementInfo] = {}
+
+    @classmethod
+    def from_nodes(cls, nodes: Iterable) -> "NodeStore":
+        """
+        Build the store from `hierarchy.iter_nodes` output.
+        """
+        store = cls()
+        for node in nodes:
+            store.append(node.parent, node.depth, node.attributes)
+        return store
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def intern(self, value: str) -> int:
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def string_id(self, value: str) -> Optional[int]:
+        """
+        The interned id of `value`, None if no node uses it.
+        """
+        return self._string_ids.get(value)
+
+    def append(self, parent: int, depth: int, attributes: Dict[str, str]) -> int:
+        index = len(self)
+        flags = 0
+        for bit, name in enumerate(self.FLAGS):
+            if attributes.get(name) == "true":
+                flags |= 1 << bit
+
+        match = _BOUNDS_PATTERN.match(attributes.get("bounds", "").strip())
+        if match:
+            self.bounds.extend(int(value) for value in match.groups())
+            flags |= self.HAS_BOUNDS
+        else:
+            self.bounds.extend((0, 0, 0, 0))
+        self.flags.append(flags)
+
+        for name, value in attributes.items():
+            if name in self.FLAGS or name == "bounds":
+                continue
+            column = self.columns.get(name)
+            if column is None:
+                # attribute seen for the first time, earlier nodes hold ""
+                column = self.columns[name] = array("i", bytes(4 * index))
+            column.append(self.intern(value.strip() if isinstance(value, str) else str(value)))
+        for column in self.columns.values():
+            if len(column) == index:
+                column.append(0)
+
+        self.parents.append(parent)
+        self.depths.append(depth)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self._last_child.append(-1)
+        if parent != -1:
+            if self.first_child[parent] == -1:
+                self.first_child[parent] = index
+            else:
+                self.next_sibling[self._last_child[parent]] = index
+            self._last_child[parent] = index
+        return index
+
+    def attr(self, index: int, name: str) -> str:
+        column = self.columns.get(name)
+        return self.strings[column[index]] if column is not None else ""
+
+    def flag(self, index: int, name: str) -> bool:
+        return bool(self.flags[index] & (1 << self.FLAGS.index(name)))
+
+    def flag_mask(self, name: str) -> int:
+        return 1 << self.FLAGS.index(name)
+
+    def get_bounds(self, index: int) -> Optional[Bounds]:
+        if not self.flags[index] & self.HAS_BOUNDS:
+            return None
+        return Bounds(*self.bounds[4 * index:4 * index + 4])
+
+    def children(self, index: int) -> Iterator[int]:
+        child = self.first_child[index]
+        while child != -1:
+            yield child
+            child = self.next_sibling[child]
+
+    def ancestors(self, index: int) -> Iterator[int]:
+        parent = self.parents[index]
+        while parent != -1:
+            yield parent
+            parent = self.parents[parent]
+
+    def attributes(self, index: int) -> ComponentNode:
+        """
+        Materialize the attributes of a node as a dict, like the raw dump.
+        """
+        result = {name: self.strings[column[index]] for name, column in self.columns.items()}
+        for name in self.FLAGS:
+            result[name] = "true" if self.flag(index, name) else "false"
+        bounds = self.get_bounds(index)
+        result["bounds"] = f"[{bounds.left},{bounds.top}][{bounds.right},{bounds.bottom}]" if bounds else ""
+        return result
+
+    def element(self, index: int) -> ElementInfo:
+        element = self._elements.get(index)
+        if element is None:
+            flags = self.flags[index]
+
+            def flag(name: str) -> bool:
+                return bool(flags & (1 << self.FLAGS.index(name)))
+
+            bounds = self.get_bounds(index)
+            element = self._elements[index] = ElementInfo(
+                id=self.attr(index, "id"),
+                key=self.attr(index, "key"),
+                type=self.attr(index, "type"),
+                text=self.attr(index, "text"),
+                description=self.attr(index, "description"),
+                isSelected=flag("selected"),
+                isChecked=flag("checked"),
+                isEnabled=flag("enabled"),
+                isFocused=flag("focused"),
+                isCheckable=flag("checkable"),
+                isClickable=flag("clickable"),
+                isLongClickable=flag("longClickable"),
+                isScrollable=flag("scrollable"),
+                bounds=bounds,
+                boundsCenter=bounds.get_center() if bounds else None)
+        return element
+
+    def nbytes(self) -> int:
+        """
+        Approximate memory used by the arrays and the string table.
+        """
+        arrays = [self.bounds, self.flags, self.parents, self.depths,
+                  self.first_child, self.next_sibling, *self.columns.values()]
+        return (sum(a.itemsize * len(a) for a in arrays)
+                + sum(len(s) + 49 for s in self.strings))
@@ -0,0 +1,264 @@
+"""
+    Batched UI actions
+    将一组点击/长按/滑动/输入/按键/等待 编译成一个设备端 shell 脚本, 一次调用执行,
+    返回每一步的退出码和耗时
+"""
+
+import math
+import re
+import shlex
+from typing import Any, Dict, List, Tuple, Union
+
+from .config import COMMAND_TIMEOUT
+from .gestures import MAX_SPEED, MIN_SPEED, drag_command, fling_command, speed_for
+from .proto import KeyCode
+from .system import _execute_command
+from .window_manager import interaction
+
+_STEP_MARKER = "HDCSTEP"
+_POINT_PATTERN = re.compile(r"(\d+)\s*,\s*(\d+)")
+# rough upper bound of the device time of one step, for the command timeout
+_STEP_TIMEOUT = 2
+
+
+def _point(step: Dict[str, Any], x: str = "x", y: str = "y") -> Tuple[int, int]:
+    if x in step and y in step:
+        return int(step[x]), int(step[y])
+    match = _POINT_PATTERN.search(str(step.get("center", "")))
+    if match is None:
+        raise ValueError(f"needs `{x}` and `{y}` or a `center` like \"(x, y)\"")
+    return int(match.group(1)), int(match.group(2))
+
+
+def key_code(key: Union[str, int]) -> int:
+    """
+    Resolve a `KeyCode` name such as "VOLUME_UP" or a numeric value.
+    """
+    if isinstance(key, int) or str(key).strip().lstrip("-").isdigit():
+        return int(key)
+    try:
+        return KeyCode[str(key).strip().upper()].value
+    except KeyError:
+        raise ValueError(f"unknown key {key}")
+
+
+# "VOLUME_UP x5" or "VOLUME_UP*5"
+_REPEAT_PATTERN = re.compile(r"^(.+?)(?:\s+[xX]\s*|\s*\*\s*)(\d+)$")
+MAX_KEY_REPEAT = 100
+# keys `uitest uiInput keyEvent` can press together
+MAX_COMBO_KEYS = 3
+
+
+def parse_keys(keys: Union[str, List[Union[str, int]]]) -> List[Tuple[str, List[int]]]:
+    """
+    Expand a key sequence into (label, key codes) events, one per key press.
+    Items are KeyCode names or values, "+" joins keys pressed together and
+    a trailing "x5" repeats the item.
+    """
+    if isinstance(keys, str):
+        keys = [item for item in keys.split(",") if item.strip()]
+    events = []
+    for item in keys:
+        text, count = str(item).strip(), 1
+        match = _REPEAT_PATTERN.match(text)
+        if match:
+            text, count = match.group(1).strip(), int(match.group(2))
+        if not 0 < count <= MAX_KEY_REPEAT:
+            raise ValueError(f"repeat count of {item} must be between 1 and {MAX_KEY_REPEAT}")
+        codes = [key_code(part) for part in text.split("+")]
+        if len(codes) > MAX_COMBO_KEYS:
+            raise ValueError(f"at most {MAX_COMBO_KEYS} keys can be pressed together: {item}")
+        events.extend([(text, codes)] * count)
+    return events
+
+
+def key_command(codes: List[int]) -> str:
+    return "uitest uiInput keyEvent " + " ".join(str(code) for code in codes)
+
+
+async def send_keys(events: List[Tuple[str, List[int]]], interval: float = 0,
+                    device: str = None) -> Tuple[int, int, str]:
+    """
+    Send key events in one shell invocation. Returns how many were sent,
+    how many of those failed, and the error output if nothing could run.
+    """
+    commands = []
+    for index, (_, codes) in enumerate(events):
+        if index and interval > 0:
+            commands.append(f"sleep {interval}")
+        commands.append(key_command(codes))
+    timeout = COMMAND_TIMEOUT + interval * len(events) + _STEP_TIMEOUT * len(events)
+    success, output = await _execute_command(
+        f"hdc shell {compile_script(commands)}", timeout=timeout, device=device
+    )
+    executed = parse_steps(output)
+    if not executed and not success:
+        return 0, 0, output
+    keys = [rc for index, (rc, _) in executed.items() if not commands[index].startswith("sleep")]
+    return len(keys), sum(1 for rc in keys if rc != 0), ""
+
+
+def compile_step(step: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    The shell command of one step and a short description of it.
+    """
+    action = step.get("action")
+    if action in ("click", "long_click"):
+        x, y = _point(step)
+        command = "click" if action == "click" else "longClick"
+        return f"uitest uiInput {command} {x} {y}", f"{action} ({x}, {y})"
+    if action == "swipe":
+        x1, y1 = _point(step, "x1", "y1")
+        x2, y2 = int(step["x2"]), int(step["y2"])
+        speed = int(step.get("speed", 1000))
+        return (f"uitest uiInput swipe {x1} {y1} {x2} {y2} {speed}",
+                f"swipe ({x1}, {y1}) -> ({x2}, {y2})")
+    if action in ("fling", "drag"):
+        x1, y1 = _point(step, "x1", "y1")
+        x2, y2 = int(step["x2"]), int(step["y2"])
+        if action == "fling":
+            velocity = max(MIN_SPEED, min(MAX_SPEED, int(step.get("velocity", 2000))))
+            step_length = int(step.get("step_length", 0)) or max(1, round(math.dist((x1, y1), (x2, y2)) / 50))
+            command = fling_command(x1, y1, x2, y2, velocity, step_length)
+        else:
+            speed = speed_for(math.dist((x1, y1), (x2, y2)), float(step.get("duration", 1.0)))
+            command = drag_command(x1, y1, x2, y2, speed)
+        return command, f"{action} ({x1}, {y1}) -> ({x2}, {y2})"
+    if action == "input_text":
+        x, y = _point(step)
+        text = str(step["text"])
+        return f"uitest uiInput inputText {x} {y} {shlex.quote(text)}", f"input_text ({x}, {y}) {text!r}"
+    if action == "key":
+        events = parse_keys([step["key"]])
+        if len(events) != 1:
+            raise ValueError("use one step per key press, or `press_keys` for repeats")
+        return key_command(events[0][1]), f"key {step['key']}"
+    if action == "wait":
+        seconds = float(step["seconds"])
+        return f"sleep {seconds}", f"wait {seconds}s"
+    raise ValueError(f"unknown action {action}")
+
+
+def compile_script(commands: List[str], stop_on_error: bool = True) -> str:
+    """
+    One shell script running `commands` in order. Every command prints a
+    marker line with its index, exit code and start/end uptime; once a
+    command failed the following ones are skipped if `stop_on_error`.
+    """
+    lines = ["__stop="]
+    for index, command in enumerate(commands):
+        on_error = "[ $__rc -ne 0 ] && __stop=1; " if stop_on_error else ""
+        lines.append(
+            f"if [ -z \"$__stop\" ]; then "
+            f"read __t0 __x </proc/uptime; {command} >/dev/null 2>&1; __rc=$?; "
+            f"read __t1 __x </proc/uptime; echo \"{_STEP_MARKER} {index} $__rc $__t0 $__t1\"; "
+            f"{on_error}fi"
+        )
+    return "\n".join(lines)
+
+
+def parse_steps(output: str) -> Dict[int, Tuple[int, float]]:
+    """
+    Index -> (exit code, seconds) of the executed steps.
+    """
+    result = {}
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) == 5 and parts[0] == _STEP_MARKER:
+            result[int(parts[1])] = (int(parts[2]), float(parts[4]) - float(parts[3]))
+    return result
+
+
+@interaction
+async def run_actions(steps: List[Dict[str, Any]], stop_on_error: bool = True, device: str = None) -> str:
+    """
+    Run several UI actions in order in a single device round trip.
+    Args:
+        steps: the actions, each a dict with an "action" and its arguments:
+            {"action": "click", "x": 100, "y": 200} (or "center": "(100, 200)")
+            {"action": "long_click", "x": 100, "y": 200}
+            {"action": "swipe", "x1": 500, "y1": 1500, "x2": 500, "y2": 500, "speed": 1000}
+            {"action": "fling", "x1": 500, "y1": 1500, "x2": 500, "y2": 500, "velocity": 3000}
+            {"action": "drag", "x1": 100, "y1": 200, "x2": 500, "y2": 200, "duration": 1.0}
+            {"action": "input_text", "x": 100, "y": 200, "text": "hello"}
+            {"action": "key", "key": "ENTER"} (a KeyCode name or value)
+            {"action": "wait", "seconds": 0.5}
+            any step may also have "wait": seconds to pause after it
+        stop_on_error: skip the remaining steps once one failed
+        device: serial from `list_devices`, omit it for the only connected device
+    Returns:
+        the status and device side duration of every step
+    """
+    if not steps:
+        return "[Fail] no steps given"
+    commands, descriptions, owners = [], [], []
+    total_wait = 0.0
+    for index, step in enumerate(steps):
+        try:
+            command, description = compile_step(step)
+            pause = float(step.get("wait", 0))
+        except (KeyError, TypeError, ValueError) as e:
+            return f"[Fail] step {index}: {e}"
+        commands.append(command)
+        descriptions.append(description)
+        owners.append(index)
+        if step.get("action") == "wait":
+            total_wait += float(step["seconds"])
+        if pause > 0:
+            commands.append(f"sleep {pause}")
+            owners.append(index)
+            total_wait += pause
+
+    timeout = COMMAND_TIMEOUT + total_wait + _STEP_TIMEOUT * len(commands)
+    success, output = await _execute_command(
+        f"hdc shell {compile_script(commands, stop_on_error)}", timeout=timeout, device=device
+    )
+    executed = parse_steps(output)
+    if not executed and not success:
+        return f"[Fail] {output}"
+
+    # fold the trailing pauses into their step
+    status: Dict[int, Tuple[int, float]] = {}
+    for command_index, (rc, seconds) in executed.items():
+        step_index = owners[command_index]
+        previous_rc, previous_seconds = status.get(step_index, (0, 0.0))
+        status[step_index] = (previous_rc or rc, previous_seconds + seconds)
+
+    lines = []
+    for index, description in enumerate(descriptions):
+        if index not in status:
+            lines.append(f"[{index}] {description}: skipped")
+            continue
+        rc, seconds = status[index]
+        state = "ok" if rc == 0 else f"failed (exit code {rc})"
+        lines.append(f"[{index}] {description}: {state} in {seconds:.2f}s")
+    failed = sum(1 for rc, _ in status.values() if rc != 0)
+    head = "[Success]" if failed == 0 and len(status) == len(steps) else "[Fail]"
+    return f"{head} {len(status)} of {len(steps)} steps run, {failed} failed\n" + "\n".join(lines)
+
+
+@interaction
+async def press_keys(keys: List[str], interval: float = 0, device: str = None) -> str:
+    """
+    Press a sequence of keys in a single device invocation.
+    Args:
+        keys: KeyCode names or values in order, e.g. ["HOME"], ["VOLUME_UP x5"],
+            ["CTRL_LEFT+A", "CTRL_LEFT+V", "ENTER"]; "+" presses up to 3 keys
+            together and a trailing "xN" repeats the item N times
+        interval: seconds to pause between key presses
+        device: serial from `list_devices`, omit it for the only connected device
+    Returns:
+        how many key presses were sent
+    """
+    try:
+        events = parse_keys(keys)
+    except ValueError as e:
+        return f"[Fail] {e}"
+    if not events:
+        return "[Fail] no keys given"
+    sent, failed, error = await send_keys(events, interval, device)
+    if sent == 0:
+        return f"[Fail] {error}"
+    if failed or sent < len(events):
+        return f"[Fail] {sent} of {len(events)} key presses sent, {failed} failed"
+    return f"[Success] {len(events)} key presses sent"
@@ -2,40 +2,113 @@
     Handle with apps
 """
 
-from typing import Union, List, Dict, Tuple
+from dataclasses import dataclass, field
+from typing import Union, List, Dict, Optional, Tuple
+import json
 import re
+import time
+from .config import APP_CACHE_TTL
+from .execption import HdcError
+from .hdc import device_key
 from .system import _execute_command
+from .window_manager import interaction
 
 
 
-async def list_app() -> List[str]:
+@dataclass
+class AppCatalogue:
+    timestamp: float                # time.monotonic() of the `bm dump -a`
+    packages: List[str]             # installed bundle names
+    # bundle name -> (bundle name, main ability) from `bm dump -n`, filled on first launch
+    entries: Dict[str, Tuple[str, str]] = field(default_factory=dict)
+
+
+# installed apps per device, None is the default device
+_catalogues: Dict[Optional[str], AppCatalogue] = {}
+
+
+def invalidate_app_cache(device: str = None, package_name: str = None):
+    """
+    Forget the installed apps of a device, or only the bundle info of one
+    package. Call it after installing or uninstalling apps.
+    """
+    device = device_key(device)
+    if package_name is None:
+        _catalogues.pop(device, None)
+    elif device in _catalogues:
+        _catalogues[device].entries.pop(package_name, None)
+
+
+async def _catalogue(device: str = None, refresh: bool = False) -> Optional[AppCatalogue]:
+    catalogue = _catalogues.get(device_key(device))
+    if (not refresh and catalogue is not None
+            and time.monotonic() - catalogue.timestamp <= APP_CACHE_TTL):
+        return catalogue
+    timestamp = time.monotonic()
+    success, result = await _execute_command(f"hdc shell bm dump -a", device=device)
+    if not success:
+        return None
+    raw = result.split('\n')
+    packages = [item.strip() for item in raw if not item.startswith("ID") and item.strip() != ""]
+    catalogue = _catalogues[device_key(device)] = AppCatalogue(timestamp, packages)
+    return catalogue
+
+
+async def list_app(refresh: bool = False, device: str = None) -> List[str]:
     """
     Get all installed packages on the device
+    Args:
+        refresh: query the device even if the list was fetched recently
+        device: serial from `list_devices`, omit it for the only connected device
     Returns:
         A list of all installed packages on the device as a string
     """
-    success, result = await _execute_command(f"hdc shell bm dump -a")
-    if success:
-        raw = result.split('\n')
-        return [item.strip() for item in raw if not item.startswith("ID") and item != ""]
+    catalogue = await _catalogue(device, refresh)
+    if catalogue is not None:
+        return list(catalogue.packages)
 
-async def has_app(package_name: str) -> bool:
+async def has_app(package_name: str, device: str = None) -> bool:
     """
     check if the given package is installed on the device
     Args:
         package_name
     """
-    apps = await list_app
-    return package_name in apps
+    catalogue = await _catalogue(device)
+    if catalogue is not None and package_name not in catalogue.packages:
+        # it may have been installed since the list was fetched
+        catalogue = await _catalogue(device, refresh=True)
+    return catalogue is not None and package_name in catalogue.packages
 
-async def stop_app(package_name: str):
-    success, result = _execute_command(f"hdc shell aa force-stop {package_name}")
+async def _main_ability(package_name: str, catalogue: AppCatalogue, device: str = None) -> Tuple[str, str]:
+    """
+    Bundle name and main ability of an installed package, from the cache or `bm dump -n`.
+    """
+    entry = catalogue.entries.get(package_name)
+    if entry is not None:
+        return entry
+    success, output = await _execute_command(f"hdc shell bm dump -n {package_name}", device=device)
+    if not success:
+        raise HdcError(f"fail when dumping app info: {output}")
+
+    json_start = output.find("{")
+    if json_start == -1:
+        raise HdcError("No such package")
+    package_info = json.loads(output[json_start:])
+    entry = catalogue.entries[package_name] = (package_info["hapModuleInfos"][0]["bundleName"],
+                                               package_info["hapModuleInfos"][0]["mainAbility"])
+    return entry
+
+@interaction
+async def stop_app(package_name: str, device: str = None):
+    success, result = await _execute_command(f"hdc shell aa force-stop {package_name}", device=device)
     if success:
         return result
 
-async def current_app() -> Tuple[str, str]:
+async def current_app(device: str = None) -> Tuple[str, str]:
     """
     Get the current foreground application information.
+    Args:
+        device: serial from `list_devices`, omit it for the only connected device
 
     Returns:
         Tuple[str, str]: A tuple contain the package_name andpage_name of the foreground application.
@@ -60,40 +133,34 @@ async def current_app() -> Tuple[str, str]:
 
         return results
 
-    success, output = await _execute_command("hdc shell aa dump -l")
+    success, output = await _execute_command("hdc shell aa dump -l", device=device)
     if success:
         results = __extract_info(output)
         return results[0] if results else (None, None)
 
-async def launch_app(package_name: str) -> str:
+@interaction
+async def launch_app(package_name: str, device: str = None) -> str:
     """
     launch app accrodingt to the given package name.
     Args:
         package_name: the package name of the package.
+        device: serial from `list_devices`, omit it for the only connected device
     """
     try:
-        if package_name not in await list_app():
+        if not await has_app(package_name, device):
             return (
                 f"[Fail] the given package {package_name} not installed."
                 " Use `list_app` to checkout the available apps"
             )
-        
-        success, output = await _execute_command(f"hdc shell bm dump -n {package_name}")
-        if not success:
-            return f"[Fail] fail when dumping app info: {output}"
-
-        json_start = output.find("{")
-        if json_start == -1:
-            return "[Fail] No such package"
-        
-        import json
-        package_info = json.loads(output[json_start:])
-
-        bundle_name = package_info["hapModuleInfos"][0]["bundleName"]
-        entry_ability = package_info["hapModuleInfos"][0]["mainAbility"]
-        
-        success, res = await _execute_command(f"hdc shell aa start -b {bundle_name} -a {entry_ability}")
+        try:
+            bundle_name, entry_ability = await _main_ability(package_name, _catalogues[device_key(device)], device)
+        except HdcError as e:
+            return f"[Fail] {e}"
+
+        success, res = await _execute_command(f"hdc shell aa start -b {bundle_name} -a {entry_ability}", device=device)
         if not success or "start ability successfully" not in res:
+            # the app may have been updated or removed, look it up again next time
+            invalidate_app_cache(device, package_name)
             return f"[Fail] {res}"
         return f"[Success] {res}"
     except BaseException as e:
@@ -0,0 +1,67 @@
+"""
+    Single round trip capture of screenshots and layout dumps
+    每次截屏/dump 只调用一次 hdc shell: 生成文件, 输出到 stdout 后随即删除
+"""
+
+import base64
+import uuid
+from typing import Dict, Optional
+
+from .execption import HdcError
+from .hdc import device_key
+from .system import _execute_command
+
+
+class DeviceCapture:
+    """
+    Produce an artifact on the device, stream it back and delete it again,
+    all in the same shell invocation.
+
+    Every capture gets its own file name, so concurrent captures never
+    collide, and nothing is left behind on the device once it returns.
+    """
+
+    def __init__(self, device: str = None):
+        self.device = device
+        self.prefix = f"/data/local/tmp/hdc_mcp_{uuid.uuid4().hex[:12]}_"
+        self._counter = 0
+
+    def _next_path(self, suffix: str) -> str:
+        self._counter += 1
+        return f"{self.prefix}{self._counter}{suffix}"
+
+    async def _run(self, produce: str, emit: str, path: str, priority: int = None) -> str:
+        # capturing leaves the UI untouched, so it may run next to other queries;
+        # the file is removed whatever happened, the status is the capture's
+        success, output = await _execute_command(
+            f"hdc shell {produce} >/dev/null && {emit} {path}; __rc=$?; rm -f {path}; [ $__rc -eq 0 ]",
+            device=self.device, read_only=True, priority=priority
+        )
+        if not success:
+            raise HdcError("HDC capture error", output)
+        return output
+
+    async def screenshot(self, priority: int = None) -> bytes:
+        """
+        Take a screenshot and return the encoded image bytes.
+        """
+        path = self._next_path(".jpeg")
+        output = await self._run(f"snapshot_display -f {path}", "base64", path, priority)
+        return base64.b64decode("".join(output.split()))
+
+    async def layout(self) -> str:
+        """
+        Dump the UI layout and return the raw json text.
+        """
+        path = self._next_path(".json")
+        return await self._run(f"uitest dumpLayout -p {path}", "cat", path)
+
+
+_captures: Dict[Optional[str], DeviceCapture] = {}
+
+
+def get_capture(device: str = None) -> DeviceCapture:
+    device = device_key(device)
+    if device not in _captures:
+        _captures[device] = DeviceCapture(device)
+    return _captures[device]
@@ -0,0 +1,182 @@
+"""
+    Native asyncio client for the hdc server
+    直接通过 TCP 与 hdc server 通信, 不再启动 hdc 命令行进程
+
+    Wire protocol:
+        every packet is a 4-byte big-endian length followed by the payload.
+        On connect the server sends a handshake (banner "OHOS HDC" + channel id),
+        the client answers with the same structure carrying the connect key
+        (the target serial, empty for the only device), then sends one
+        NUL-terminated command such as "shell ls" or "file recv a b".
+        The server streams the output back and closes the channel when done.
+"""
+
+import asyncio
+import os
+import struct
+import uuid
+from typing import List, Tuple
+
+from . import logger
+from .config import HDC_SERVER_HOST, HDC_SERVER_PORT
+from .proto import CommandResult
+from .execption import HdcError
+
+HANDSHAKE_BANNER = b"OHOS HDC"
+BANNER_SIZE = 12
+CONNECT_KEY_SIZE = 32
+
+
+def pack_packet(payload: bytes) -> bytes:
+    return struct.pack(">I", len(payload)) + payload
+
+
+def pack_command(command: str) -> bytes:
+    return pack_packet(command.encode("utf-8") + b"\0")
+
+
+def pack_handshake(connect_key: str, template: bytes = b"") -> bytes:
+    """
+    Build the client handshake, keeping any trailing fields (e.g. version)
+    the server sent in its own handshake.
+    """
+    key = connect_key.encode("utf-8")
+    if len(key) > CONNECT_KEY_SIZE:
+        raise HdcError("connect key too long", connect_key)
+    banner = HANDSHAKE_BANNER.ljust(BANNER_SIZE, b"\0")
+    body = banner + key.ljust(CONNECT_KEY_SIZE, b"\0")
+    return pack_packet(body + template[len(body):])
+
+
+def parse_targets(output: str) -> List[str]:
+    return [line.strip() for line in output.splitlines()
+            if line.strip() and line.strip() != "[Empty]"]
+
+
+async def read_packet(reader: asyncio.StreamReader) -> bytes:
+    """
+    Read one length-prefixed packet, return b"" when the channel is closed.
+    """
+    try:
+        header = await reader.readexactly(4)
+        size, = struct.unpack(">I", header)
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        return b""
+
+
+class HdcClient:
+    """
+    Talk to the hdc server over TCP.
+
+    A channel serves exactly one command, so the pool keeps `pool_size`
+    connections that already finished the handshake; taking one out
+    triggers a replacement in the background.
+    """
+
+    def __init__(self, host: str = None, port: int = None,
+                 connect_key: str = "", pool_size: int = 4):
+        self.host = host or HDC_SERVER_HOST
+        self.port = port or HDC_SERVER_PORT
+        self.connect_key = connect_key
+        self.pool_size = pool_size
+        self._pool: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._refill: asyncio.Task = None
+
+    async def _open_channel(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        handshake = await read_packet(reader)
+        if not handshake.startswith(HANDSHAKE_BANNER):
+            writer.close()
+            raise HdcError("hdc server handshake error", handshake[:BANNER_SIZE])
+        writer.write(pack_handshake(self.connect_key, handshake))
+        await writer.drain()
+        return reader, writer
+
+    async def _fill_pool(self):
+        try:
+            while len(self._pool) < self.pool_size:
+                self._pool.append(await self._open_channel())
+        except (OSError, HdcError) as e:
+            logger.debug(f"fail to warm up hdc channel: {e}")
+
+    async def _acquire(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        channel = None
+        while self._pool:
+            reader, writer = self._pool.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                channel = reader, writer
+                break
+            writer.close()
+        if channel is None:
+            channel = await self._open_channel()
+        if self._refill is None or self._refill.done():
+            self._refill = asyncio.create_task(self._fill_pool())
+        return channel
+
+    async def command(self, command: str, timeout: float = None) -> bytes:
+        """
+        Send one command and return everything the server sent back.
+        """
+        reader, writer = await self._acquire()
+
+        async def _collect() -> bytes:
+            chunks = []
+            while packet := await read_packet(reader):
+                chunks.append(packet)
+            return b"".join(chunks)
+
+        try:
+            writer.write(pack_command(command))
+            await writer.drain()
+            return await asyncio.wait_for(_collect(), timeout=timeout)
+        finally:
+            writer.close()
+
+    async def shell(self, cmd: str, timeout: float = None) -> CommandResult:
+        """
+        Run `cmd` on the device. The remote shell merges stdout and stderr,
+        the exit code is carried by a trailing marker line.
+        """
+        token = uuid.uuid4().hex[:16]
+        # on a line of its own, so a trailing comment or `&` cannot swallow it
+        script = f"{cmd}\nprintf '\\n%s %d\\n' \"HDCRC\"\"{token}\" $?"
+        raw = await self.command(f"shell {script}", timeout=timeout)
+        text = raw.decode("utf-8", errors="replace").replace("\r\n", "\n")
+        marker = f"\nHDCRC{token} "
+        pos = text.rfind(marker)
+        if pos == -1:
+            return CommandResult(output=text, error="", exit_code=-1)
+        exit_code = int(text[pos + len(marker):].split()[0])
+        output = text[:pos]
+        if exit_code != 0:
+            return CommandResult(output="", error=output, exit_code=exit_code)
+        return CommandResult(output=output, error="", exit_code=exit_code)
+
+    async def recv_file(self, rpath: str, lpath: str, timeout: float = None) -> str:
+        """
+        Ask the server to pull `rpath` from the device to `lpath` on this host.
+        """
+        lpath = os.path.abspath(lpath)
+        raw = await self.command(f"file recv {rpath} {lpath}", timeout=timeout)
+        return raw.decode("utf-8", errors="replace")
+
+    async def list_targets(self) -> List[str]:
+        raw = await self.command("list targets")
+        return parse_targets(raw.decode("utf-8"))
+
+    async def close(self):
+        if self._refill is not None:
+            self._refill.cancel()
+        for _, writer in self._pool:
+            writer.close()
+        self._pool.clear()
+
+
+_clients = {}
+
+
+def get_client(connect_key: str = "") -> HdcClient:
+    if connect_key not in _clients:
+        _clients[connect_key] = HdcClient(connect_key=connect_key)
+    return _clients[connect_key]
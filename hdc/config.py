@@ -0,0 +1,73 @@
+"""
+    Runtime configuration
+    所有配置项均可通过环境变量覆盖
+"""
+
+import os
+
+# How `hdc shell` commands are executed:
+#   "session": reuse one long-lived `hdc shell` process per device
+#   "spawn":   start a fresh `hdc` process for every command
+#   "native":  talk to the hdc server over TCP without any `hdc` process
+SHELL_MODE = os.getenv("HDC_SHELL_MODE", "session")
+
+# default command execution timeout in seconds
+COMMAND_TIMEOUT = float(os.getenv("HDC_COMMAND_TIMEOUT", "10"))
+
+# hdc server address used by the "native" mode; setting either variable
+# also points every `hdc` command at that server (`hdc -s host:port`)
+HDC_SERVER_HOST = os.getenv("HDC_SERVER_HOST", "127.0.0.1")
+HDC_SERVER_PORT = int(os.getenv("HDC_SERVER_PORT", "8710"))
+HDC_REMOTE_SERVER = "HDC_SERVER_HOST" in os.environ or "HDC_SERVER_PORT" in os.environ
+
+# commands run at the same time on one device (mutating ones still run one
+# at a time), each device has its own scheduler
+DEVICE_CONCURRENCY = int(os.getenv("HDC_DEVICE_CONCURRENCY", "4"))
+
+# read-only shell commands sent to one device within this many seconds are merged into
+# one `hdc shell` invocation, at most COALESCE_MAX_BATCH of them; on by
+# default only in "spawn" mode, where every invocation starts a process
+COALESCE_WINDOW = float(os.getenv("HDC_COALESCE_WINDOW", "0.002" if SHELL_MODE == "spawn" else "0"))
+COALESCE_MAX_BATCH = int(os.getenv("HDC_COALESCE_MAX_BATCH", "16"))
+
+# How UI input (click, swipe, text) is sent to the device:
+#   "shell": one `uitest uiInput ...` command per action
+#   "rpc":   JSON-RPC calls to the uitest agent over a forwarded port
+UI_BACKEND = os.getenv("HDC_UI_BACKEND", "shell")
+
+# `input_text` types text longer than this through the uitest agent, or
+# in chunks of this many characters on the shell; the command timeout grows
+# by TYPING_SECONDS_PER_CHAR for every character
+INPUT_CHUNK_SIZE = int(os.getenv("HDC_INPUT_CHUNK_SIZE", "256"))
+TYPING_SECONDS_PER_CHAR = float(os.getenv("HDC_TYPING_SECONDS_PER_CHAR", "0.02"))
+
+# seconds a cached layout dump stays valid even without any interaction,
+# 0 keeps it until the next click/swipe/key event
+HIERARCHY_CACHE_MAX_AGE = float(os.getenv("HDC_HIERARCHY_CACHE_MAX_AGE", "0"))
+
+# screenshots returned by `get_screenshot`: scale factor of the device
+# resolution, encoding ("jpeg", "webp" or "png") and jpeg/webp quality
+SCREENSHOT_SCALE = float(os.getenv("HDC_SCREENSHOT_SCALE", "0.3"))
+SCREENSHOT_FORMAT = os.getenv("HDC_SCREENSHOT_FORMAT", "jpeg").lower()
+SCREENSHOT_QUALITY = int(os.getenv("HDC_SCREENSHOT_QUALITY", "85"))
+
+# frames whose difference hashes differ in at most this many of 256 bits
+# count as the same screen, `get_screenshot` then reuses the last image;
+# -1 always encodes a new one
+SCREENSHOT_HASH_THRESHOLD = int(os.getenv("HDC_SCREENSHOT_HASH_THRESHOLD", "0"))
+
+# `get_screenshot(delta=True)`: frames are compared in tiles of this many
+# device pixels, and the full screen is sent when more than this fraction
+# of the tiles changed
+SCREENSHOT_TILE_SIZE = int(os.getenv("HDC_SCREENSHOT_TILE_SIZE", "64"))
+SCREENSHOT_DELTA_MAX_RATIO = float(os.getenv("HDC_SCREENSHOT_DELTA_MAX_RATIO", "0.5"))
+
+# seconds the list of installed apps is reused before `bm dump -a` runs again
+APP_CACHE_TTL = float(os.getenv("HDC_APP_CACHE_TTL", "300"))
+
+# after a UI action, wait until the "screen" or the "layout" stops changing,
+# polling every SETTLE_INTERVAL seconds with backoff for at most
+# SETTLE_MAX_WAIT seconds; "none" returns right after the action
+SETTLE_SIGNAL = os.getenv("HDC_SETTLE_SIGNAL", "none").lower()
+SETTLE_MAX_WAIT = float(os.getenv("HDC_SETTLE_MAX_WAIT", "3"))
+SETTLE_INTERVAL = float(os.getenv("HDC_SETTLE_INTERVAL", "0.05"))
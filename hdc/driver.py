@@ -0,0 +1,224 @@
+"""
+    uitest agent RPC driver
+    启动设备端 uitest 守护进程, 转发端口后通过常驻 socket 发送 Hypium JSON-RPC 调用
+"""
+
+import asyncio
+import json
+import uuid
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from . import logger
+from .config import COMMAND_TIMEOUT, HDC_SERVER_HOST, HDC_REMOTE_SERVER
+from .execption import HdcError
+from .hdc import device_key
+from .proto import HypiumResponse, ByData, DriverData, ComponentData, Point, PointerMatrixData
+from .system import _execute_command
+from .utils import FreePort
+
+HYPIUM_MODULE = "com.ohos.devicetest.hypiumApiHelper"
+AGENT_PORT = 8012
+_READ_SIZE = 64 * 1024
+
+_free_port = FreePort()
+
+
+class UitestDriver:
+    """
+    Send Hypium API calls to the on-device uitest agent over one socket.
+
+    The agent is started and the port forwarded on first use; any socket
+    error drops the connection so that the next call sets it up again.
+    With `port` the driver talks to an agent already listening there, e.g.
+    `hdc.fake_agent.FakeAgent`, and starts nothing on the device.
+    """
+
+    def __init__(self, device: str = None, host: str = None, port: int = None):
+        self.device = device
+        # forwarded ports listen on the host running the hdc server
+        self._host = host or (HDC_SERVER_HOST if HDC_REMOTE_SERVER else "127.0.0.1")
+        self._attached = port is not None
+        self._local_port: int = port
+        self._reader: asyncio.StreamReader = None
+        self._writer: asyncio.StreamWriter = None
+        self._driver: DriverData = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _start_agent(self):
+        if self._attached:
+            return
+        success, result = await _execute_command("hdc shell uitest start-daemon singleness", device=self.device)
+        if not success:
+            raise HdcError("fail to start uitest agent", result)
+        if self._local_port is None:
+            port = _free_port.get()
+            success, result = await _execute_command(f"hdc fport tcp:{port} tcp:{AGENT_PORT}", device=self.device)
+            if not success:
+                raise HdcError("fail to forward uitest agent port", result)
+            self._local_port = port
+
+    async def _connect(self):
+        await self._start_agent()
+        self._reader, self._writer = await asyncio.open_connection(self._host, self._local_port)
+        response, = await self._request([self._message("callHypiumApi", "Driver.create", None, [])])
+        self._driver = DriverData(response.result)
+        logger.debug(f"uitest agent connected on port {self._local_port}: {self._driver.value}")
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = self._driver = None
+
+    @staticmethod
+    def _message(method: str, api: str, this: Union[str, None], args: List) -> Dict:
+        params = {"api": api, "args": args}
+        if method == "callHypiumApi":
+            params.update({"this": this, "message_type": "hypium"})
+        return {
+            "module": HYPIUM_MODULE,
+            "method": method,
+            "params": params,
+            "request_id": uuid.uuid4().hex
+        }
+
+    async def _request(self, messages: List[Dict]) -> List[HypiumResponse]:
+        """
+        Send `messages` in one write and read one answer per message, in order.
+        """
+        self._writer.write(b"".join(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+                                    for message in messages))
+        await self._writer.drain()
+
+        # the agent answers with JSON documents without any framing
+        decoder = json.JSONDecoder()
+        answers = []
+        buffer = b""
+        while len(answers) < len(messages):
+            chunk = await self._reader.read(_READ_SIZE)
+            if not chunk:
+                raise ConnectionError("uitest agent closed the connection")
+            buffer += chunk
+            while len(answers) < len(messages) and buffer.rstrip().endswith(b"}"):
+                try:
+                    text = buffer.decode("utf-8").lstrip()
+                    data, end = decoder.raw_decode(text)
+                except (UnicodeDecodeError, ValueError):
+                    break
+                answers.append(data)
+                buffer = text[end:].encode("utf-8")
+        responses = [HypiumResponse(**{k: data.get(k) for k in ("result", "exception")}) for data in answers]
+        for response in responses:
+            if response.exception:
+                raise HdcError("uitest agent error", response.exception)
+        return responses
+
+    async def _call(self, calls: List[Tuple[str, str, Union[str, None], List]]) -> List[HypiumResponse]:
+        async with self._lock:
+            try:
+                if not self.connected:
+                    # an agent that accepts but never answers must not hold the lock forever
+                    await asyncio.wait_for(self._connect(), timeout=COMMAND_TIMEOUT)
+                messages = [self._message(method, api, self._driver.value if this == "Driver#0" else this, args)
+                            for method, api, this, args in calls]
+                return await asyncio.wait_for(self._request(messages), timeout=COMMAND_TIMEOUT)
+            except HdcError:
+                # the agent answered; only a failed setup leaves the connection unusable
+                if self._driver is None:
+                    self._disconnect()
+                raise
+            except BaseException:
+                self._disconnect()
+                raise
+
+    async def invoke(self, api: str, this: Union[str, None] = "Driver#0", args: List = None) -> HypiumResponse:
+        return (await self._call([("callHypiumApi", api, this, args or [])]))[0]
+
+    async def invoke_many(self, calls: List[Tuple[str, Union[str, None], List]]) -> List[HypiumResponse]:
+        """
+        Pipeline several (api, this, args) calls: all are sent at once and
+        the answers read back in order, one round trip in total.
+        """
+        return await self._call([("callHypiumApi", api, this, args) for api, this, args in calls])
+
+    async def invoke_captures(self, api: str, args: List = None) -> HypiumResponse:
+        return (await self._call([("Captures", api, None, args or [])]))[0]
+
+    async def click(self, x: int, y: int):
+        await self.invoke("Driver.click", args=[x, y])
+
+    async def long_click(self, x: int, y: int):
+        await self.invoke("Driver.longClick", args=[x, y])
+
+    async def swipe(self, x1: int, y1: int, x2: int, y2: int, speed: int = 1000):
+        await self.invoke("Driver.swipe", args=[x1, y1, x2, y2, speed])
+
+    async def fling(self, x1: int, y1: int, x2: int, y2: int, step_length: int, speed: int):
+        await self.invoke("Driver.fling", args=[Point(x1, y1).to_dict(), Point(x2, y2).to_dict(),
+                                                 step_length, speed])
+
+    async def drag(self, x1: int, y1: int, x2: int, y2: int, speed: int):
+        await self.invoke("Driver.drag", args=[x1, y1, x2, y2, speed])
+
+    async def multi_pointer(self, paths: List[List[Point]], speed: int):
+        """
+        Move one finger along each path at the same time, `speed` pixels per
+        second between consecutive points. All paths need the same length.
+        Two round trips: creating the pointer matrix, then its points and the
+        injection pipelined.
+        """
+        response = await self.invoke("PointerMatrix.create", this=None, args=[len(paths), len(paths[0])])
+        matrix = PointerMatrixData(response.result)
+        calls = [("PointerMatrix.setPoint", matrix.value, [finger, step, point.to_dict()])
+                 for finger, path in enumerate(paths) for step, point in enumerate(path)]
+        calls.append(("Driver.injectMultiPointerAction", "Driver#0", [matrix.value, speed]))
+        responses = await self.invoke_many(calls)
+        if responses[-1].result is False:
+            raise HdcError("uitest agent rejected the gesture", paths)
+
+    async def input_text(self, x: int, y: int, text: str):
+        await self.invoke("Driver.inputText", args=[Point(x, y).to_dict(), text])
+
+    async def press_key(self, code: int):
+        await self.invoke("Driver.triggerKey", args=[code])
+
+    async def dump_layout(self) -> Dict[str, Any]:
+        response = await self.invoke_captures("captureLayout")
+        if isinstance(response.result, str):
+            return json.loads(response.result)
+        return response.result
+
+    async def by(self, attribute: str, value: Any) -> ByData:
+        """
+        Build a selector, e.g. `by("text", "OK")` or `by("key", "btn_ok")`.
+        """
+        response = await self.invoke(f"On.{attribute}", this="On#seed", args=[value])
+        return ByData(response.result)
+
+    async def find_component(self, by: ByData) -> Union[ComponentData, None]:
+        response = await self.invoke("Driver.findComponent", args=[by.value])
+        return ComponentData(response.result) if response.result else None
+
+    async def click_component(self, component: ComponentData):
+        await self.invoke("Component.click", this=component.value)
+
+    async def close(self):
+        async with self._lock:
+            self._disconnect()
+            if self._local_port is not None and not self._attached:
+                await _execute_command(f"hdc fport rm tcp:{self._local_port} tcp:{AGENT_PORT}",
+                                       device=self.device)
+                self._local_port = None
+
+
+_drivers: Dict[Optional[str], UitestDriver] = {}
+
+
+def get_driver(device: str = None) -> UitestDriver:
+    device = device_key(device)
+    if device not in _drivers:
+        _drivers[device] = UitestDriver(device)
+    return _drivers[device]
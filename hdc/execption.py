@@ -11,4 +11,7 @@ class DeviceAmbigiousError(DeviceError):
     pass
 
 class HdcError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class SessionSpawnError(HdcError):
+    pass
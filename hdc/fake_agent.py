@@ -0,0 +1,72 @@
+"""
+    Stand-in uitest agent answering Hypium calls
+    不连接设备, 按 uitest agent 的方式逐条回复无分帧的 JSON, 创建类 API 返回
+    "PointerMatrix#1" 之类的句柄, 用于测试 UitestDriver 的流水线调用
+"""
+
+import asyncio
+import json
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import logger
+
+
+class FakeAgent:
+    """
+    Speak the agent side of the uitest Hypium socket.
+
+    Every newline-delimited message is answered in order with one JSON
+    document and no framing, like the real agent. A `<Class>.create` call
+    returns a new handle such as "Driver#1"; other calls return what
+    `results` holds for their API, null by default, and an `Exception`
+    there is answered as an agent error. With `chunk_size` the answers are
+    written in pieces of that many bytes, so the reader has to join them.
+    """
+
+    def __init__(self, results: Dict[str, Any] = None, chunk_size: int = 0):
+        self.results: Dict[str, Any] = {"Driver.injectMultiPointerAction": True, **(results or {})}
+        self.chunk_size = chunk_size
+        # (api, this, args) of every call received, in order
+        self.requests: List[Tuple[str, Optional[str], List]] = []
+        self._handles: Dict[str, int] = defaultdict(int)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self._server = await asyncio.start_server(self._serve, host, port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def _answer(self, message: Dict) -> Dict:
+        params = message.get("params", {})
+        api = params.get("api", "")
+        self.requests.append((api, params.get("this"), params.get("args", [])))
+        kind, _, name = api.rpartition(".")
+        if name == "create" and api not in self.results:
+            self._handles[kind] += 1
+            return {"result": f"{kind}#{self._handles[kind]}"}
+        result = self.results.get(api)
+        if isinstance(result, Exception):
+            return {"exception": {"message": str(result)}}
+        return {"result": result}
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                data = json.dumps(self._answer(json.loads(line))).encode("utf-8")
+                size = self.chunk_size or len(data)
+                for start in range(0, len(data), size):
+                    writer.write(data[start:start + size])
+                    await writer.drain()
+        except (OSError, ValueError) as e:
+            logger.debug(f"fake agent channel closed: {e}")
+        finally:
+            writer.close()
@@ -0,0 +1,110 @@
+"""
+    Background screen capture into a ring buffer
+    后台按固定频率截屏, 最近的若干帧保存在内存中; 无人读取时自动降频
+"""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Optional
+
+from . import logger
+
+
+@dataclass
+class Frame:
+    seq: int            # increasing frame number, starting at 1
+    timestamp: float    # time.time() when the capture started
+    epoch: int          # interaction epoch when the capture started
+    data: bytes         # encoded image as captured on the device
+
+
+class FrameRecorder:
+    """
+    Capture frames in a background task at `fps`, keeping the last
+    `buffer_size` of them. When no frame has been read for `idle_after`
+    seconds the rate drops to `idle_fps` until the next read.
+    """
+
+    def __init__(self, capture: Callable[[], Awaitable[bytes]], epoch: Callable[[], int],
+                 fps: float = 2.0, buffer_size: int = 8,
+                 idle_after: float = 10.0, idle_fps: float = 0.2):
+        self._capture = capture
+        self._epoch = epoch
+        self.fps = fps
+        self.idle_after = idle_after
+        self.idle_fps = idle_fps
+        self.frames: Deque[Frame] = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._last_read = time.monotonic()
+        self._new_frame = asyncio.Condition()
+        self._reader_waiting = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._last_read = time.monotonic()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _interval(self) -> float:
+        idle = time.monotonic() - self._last_read > self.idle_after
+        return 1 / (self.idle_fps if idle else self.fps)
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            timestamp, epoch = time.time(), self._epoch()
+            # a reader arriving from here on needs a later frame than this one
+            self._reader_waiting.clear()
+            try:
+                data = await self._capture()
+            except Exception as e:
+                logger.warning(f"background capture failed: {e}")
+            else:
+                self._seq += 1
+                self.frames.append(Frame(self._seq, timestamp, epoch, data))
+                async with self._new_frame:
+                    self._new_frame.notify_all()
+            # a waiting reader cuts an idle pause short
+            try:
+                await asyncio.wait_for(self._reader_waiting.wait(),
+                                       max(0.0, self._interval() - (time.monotonic() - started)))
+            except asyncio.TimeoutError:
+                pass
+
+    def latest(self) -> Optional[Frame]:
+        self._last_read = time.monotonic()
+        return self.frames[-1] if self.frames else None
+
+    async def wait_for_frame(self, newer_than: float, timeout: float = 5.0) -> Optional[Frame]:
+        """
+        Wait for a frame whose capture started after `newer_than` (a
+        time.time() timestamp), None on timeout.
+        """
+        self._last_read = time.monotonic()
+        self._reader_waiting.set()
+
+        def _newer() -> bool:
+            return bool(self.frames) and self.frames[-1].timestamp > newer_than
+
+        async with self._new_frame:
+            try:
+                await asyncio.wait_for(self._new_frame.wait_for(_newer), timeout=timeout)
+            except asyncio.TimeoutError:
+                return None
+        self._last_read = time.monotonic()
+        return self.frames[-1]
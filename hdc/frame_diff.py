@@ -0,0 +1,59 @@
+"""
+    Tile based comparison of two screen frames
+    将画面划分为网格, 找出与上一帧不同的区域
+"""
+
+from typing import List, Optional, Set, Tuple
+
+from PIL import Image as PILImage, ImageChops
+
+# gray level difference below which a pixel counts as unchanged (JPEG noise)
+PIXEL_THRESHOLD = 24
+
+Tile = Tuple[int, int]
+Region = Tuple[int, int, int, int]
+
+
+def changed_tiles(old: PILImage.Image, new: PILImage.Image, tile: int) -> Optional[Set[Tile]]:
+    """
+    (column, row) of the `tile` x `tile` pixel cells that differ between
+    two grayscale thumbnails, None if their sizes do not match.
+    """
+    if old.size != new.size:
+        return None
+    mask = ImageChops.difference(old, new).point(lambda v: 255 if v > PIXEL_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return set()
+    left, top, right, bottom = bbox
+    tiles = set()
+    for row in range(top // tile, (bottom - 1) // tile + 1):
+        for col in range(left // tile, (right - 1) // tile + 1):
+            if mask.crop((col * tile, row * tile, (col + 1) * tile, (row + 1) * tile)).getbbox():
+                tiles.add((col, row))
+    return tiles
+
+
+def tile_regions(tiles: Set[Tile]) -> List[Region]:
+    """
+    Bounding boxes (left, top, right, bottom), in tiles, of the groups of
+    touching tiles, top to bottom.
+    """
+    regions = []
+    remaining = set(tiles)
+    while remaining:
+        stack = [remaining.pop()]
+        left, top = stack[0]
+        right, bottom = left + 1, top + 1
+        while stack:
+            col, row = stack.pop()
+            left, top = min(left, col), min(top, row)
+            right, bottom = max(right, col + 1), max(bottom, row + 1)
+            for dc in (-1, 0, 1):
+                for dr in (-1, 0, 1):
+                    neighbour = (col + dc, row + dr)
+                    if neighbour in remaining:
+                        remaining.remove(neighbour)
+                        stack.append(neighbour)
+        regions.append((left, top, right, bottom))
+    return sorted(regions, key=lambda region: (region[1], region[0]))
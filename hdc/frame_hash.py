@@ -0,0 +1,47 @@
+"""
+    Perceptual hash of screen frames
+    差异哈希 (dHash), 用于判断两帧画面是否相同或几乎相同
+"""
+
+import io
+
+from PIL import Image as PILImage
+
+HASH_SIZE = 16
+# frames are compared on a grayscale copy this many times smaller
+THUMBNAIL_SCALE = 8
+
+
+def thumbnail(data: bytes) -> PILImage.Image:
+    """
+    Grayscale copy of an encoded frame reduced THUMBNAIL_SCALE times,
+    shared by the hash and the tile comparison. CPU bound, run in an executor.
+    """
+    with PILImage.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        size = (max(1, width // THUMBNAIL_SCALE), max(1, height // THUMBNAIL_SCALE))
+        # the JPEG decoder does most of the downscaling for free
+        img.draft("L", size)
+        return img.convert("L").resize(size, PILImage.Resampling.BILINEAR)
+
+
+def dhash(image: PILImage.Image, size: int = HASH_SIZE) -> int:
+    """
+    Difference hash of a frame thumbnail: the image is reduced to a
+    (size + 1) x size grayscale grid and every bit tells whether a pixel
+    is brighter than its right neighbour.
+    """
+    pixels = list(image.resize((size + 1, size), PILImage.Resampling.BILINEAR).getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    """
+    Number of differing bits between two hashes.
+    """
+    return bin(a ^ b).count("1")
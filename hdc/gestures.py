@@ -0,0 +1,184 @@
+"""
+    Gestures
+    折线滑动、按速度甩动 (fling)、长按后拖动、双指捏合/放大;
+    时长换算为速度; 单段手势一次设备调用, 折线/多指手势经 uitest agent 两次往返
+    (创建 PointerMatrix, 再流水线发送所有点和注入)
+"""
+
+import math
+import re
+from typing import List, Sequence, Tuple, Union
+
+from .config import COMMAND_TIMEOUT
+from .proto import Point
+from .system import _execute_command
+from .window_manager import _rpc, interaction
+
+# speeds `uitest uiInput` accepts, in pixels per second
+MIN_SPEED = 200
+MAX_SPEED = 40000
+# points per finger of one multi-pointer gesture
+MAX_PATH_POINTS = 64
+_POINT_PATTERN = re.compile(r"(\d+)\s*,\s*(\d+)")
+
+Path = List[Tuple[int, int]]
+
+
+def parse_points(points: Union[str, Sequence]) -> Path:
+    """
+    Points given as "(x1, y1) (x2, y2) ...", a list of such strings or a
+    list of [x, y] pairs.
+    """
+    if isinstance(points, str):
+        points = [points]
+    result = []
+    for item in points:
+        if isinstance(item, (list, tuple)) and len(item) == 2:
+            result.append((int(item[0]), int(item[1])))
+            continue
+        matches = _POINT_PATTERN.findall(str(item))
+        if not matches:
+            raise ValueError(f"points should be given like \"(x, y)\": {item}")
+        result.extend((int(x), int(y)) for x, y in matches)
+    return result
+
+
+def path_length(path: Path) -> float:
+    return sum(math.dist(a, b) for a, b in zip(path, path[1:]))
+
+
+def speed_for(length: float, duration: float) -> int:
+    """
+    The speed moving `length` pixels in `duration` seconds, clamped to
+    what uitest accepts.
+    """
+    if duration <= 0:
+        return MAX_SPEED
+    return max(MIN_SPEED, min(MAX_SPEED, round(length / duration)))
+
+
+def pinch_paths(x: int, y: int, start: int, end: int, angle: float = 0) -> List[Path]:
+    """
+    Two fingers on opposite sides of (x, y) moving from `start` to `end`
+    pixels apart, along a line `angle` degrees from the horizontal.
+    """
+    dx, dy = math.cos(math.radians(angle)) / 2, math.sin(math.radians(angle)) / 2
+    return [
+        [(round(x - dx * start), round(y - dy * start)), (round(x - dx * end), round(y - dy * end))],
+        [(round(x + dx * start), round(y + dy * start)), (round(x + dx * end), round(y + dy * end))],
+    ]
+
+
+def fling_command(x1: int, y1: int, x2: int, y2: int, velocity: int, step_length: int) -> str:
+    return f"uitest uiInput fling {x1} {y1} {x2} {y2} {velocity} {step_length}"
+
+
+def drag_command(x1: int, y1: int, x2: int, y2: int, speed: int) -> str:
+    return f"uitest uiInput drag {x1} {y1} {x2} {y2} {speed}"
+
+
+def _report(what: str, length: float, speed: int) -> str:
+    return f"[Success] {what}: {length:.0f}px at {speed}px/s in {length / speed:.2f}s"
+
+
+async def _shell(command: str, seconds: float, device: str = None) -> Tuple[bool, str]:
+    return await _execute_command(f"hdc shell {command}", timeout=COMMAND_TIMEOUT + seconds, device=device)
+
+
+@interaction
+async def swipe_path(points: Union[str, List], duration: float = 0.5, device: str = None) -> str:
+    """
+    Move one finger through several points without lifting it, at a steady
+    speed so that the whole path takes `duration`. A slow path scrolls
+    content by about its length, unlike a `fling`.
+    Args:
+        points: at least two points, e.g. "(540, 1800) (540, 900) (900, 900)"
+        duration: seconds the whole path takes
+        device: serial from `list_devices`, omit it for the only connected device
+    """
+    try:
+        path = parse_points(points)
+    except (TypeError, ValueError) as e:
+        return f"[Fail] {e}"
+    if not 2 <= len(path) <= MAX_PATH_POINTS:
+        return f"[Fail] a path needs between 2 and {MAX_PATH_POINTS} points"
+    length = path_length(path)
+    speed = speed_for(length, duration)
+    what = f"path through {len(path)} points"
+    # a single segment is a plain swipe, the shell can do that as well
+    if await _rpc("multi_pointer", [[Point(*p) for p in path]], speed, device=device, force=len(path) > 2):
+        return _report(what, length, speed)
+    if len(path) > 2:
+        return "[Fail] paths with several segments need the uitest agent, which is not reachable"
+    (x1, y1), (x2, y2) = path
+    success, output = await _shell(f"uitest uiInput swipe {x1} {y1} {x2} {y2} {speed}", length / speed, device)
+    return _report(what, length, speed) if success else f"[Fail] {output}"
+
+
+@interaction
+async def fling(x1: int, y1: int, x2: int, y2: int, velocity: int = 2000,
+                step_length: int = 0, device: str = None) -> str:
+    """
+    Fling from (x1, y1) towards (x2, y2), releasing at `velocity` so that
+    scrollable content keeps moving afterwards.
+    Args:
+        velocity: release speed in pixels per second, 200 to 40000
+        step_length: pixels between injected move events, 0 for distance / 50
+        device: serial from `list_devices`, omit it for the only connected device
+    """
+    velocity = max(MIN_SPEED, min(MAX_SPEED, int(velocity)))
+    length = math.dist((x1, y1), (x2, y2))
+    step_length = int(step_length) or max(1, round(length / 50))
+    what = f"fling ({x1}, {y1}) -> ({x2}, {y2})"
+    if await _rpc("fling", x1, y1, x2, y2, step_length, velocity, device=device):
+        return _report(what, length, velocity)
+    success, output = await _shell(fling_command(x1, y1, x2, y2, velocity, step_length),
+                                   length / velocity, device)
+    return _report(what, length, velocity) if success else f"[Fail] {output}"
+
+
+@interaction
+async def drag(x1: int, y1: int, x2: int, y2: int, duration: float = 1.0, device: str = None) -> str:
+    """
+    Long press at (x1, y1), then drag to (x2, y2) and release, e.g. to move
+    an icon or reorder a list item.
+    Args:
+        duration: seconds the move after the long press takes
+        device: serial from `list_devices`, omit it for the only connected device
+    """
+    length = math.dist((x1, y1), (x2, y2))
+    speed = speed_for(length, duration)
+    what = f"drag ({x1}, {y1}) -> ({x2}, {y2})"
+    if await _rpc("drag", x1, y1, x2, y2, speed, device=device):
+        return _report(what, length, speed)
+    success, output = await _shell(drag_command(x1, y1, x2, y2, speed), length / speed, device)
+    return _report(what, length, speed) if success else f"[Fail] {output}"
+
+
+@interaction
+async def pinch(center: str, start_distance: int, end_distance: int, duration: float = 0.5,
+                angle: float = 0, device: str = None) -> str:
+    """
+    Two finger pinch around a point: zoom in if the fingers move apart,
+    zoom out if they move together.
+    Args:
+        center: a string like "(x, y)", sample: "(540, 1200)"
+        start_distance: pixels between the fingers at the start
+        end_distance: pixels between the fingers at the end
+        duration: seconds the pinch takes
+        angle: direction of the fingers in degrees, 0 is horizontal
+        device: serial from `list_devices`, omit it for the only connected device
+    """
+    try:
+        (x, y), = parse_points(center)
+    except (TypeError, ValueError):
+        return "[Fail] The center should be given like `(540, 1200)`"
+    paths = pinch_paths(x, y, int(start_distance), int(end_distance), float(angle))
+    # each finger moves half the change of the distance
+    length = abs(int(end_distance) - int(start_distance)) / 2
+    speed = speed_for(length, duration)
+    what = "zoom in" if end_distance > start_distance else "zoom out"
+    fingers = [[Point(*p) for p in path] for path in paths]
+    if await _rpc("multi_pointer", fingers, speed, device=device, force=True):
+        return _report(f"{what} around ({x}, {y})", length, speed)
+    return "[Fail] pinch needs the uitest agent, which is not reachable"
@@ -1,31 +1,124 @@
 # -*- coding: utf-8 -*-
+"""
+    Device registry
+    通过 `hdc list targets` 发现设备, 每台设备有独立的 hdc 命令前缀
+"""
+
 import asyncio
-import re
-from .system import launch_package
-# def _build_hdc_prefix() -> str:
-#     """
-#     Construct the hdc command prefix based on environment variables.
-#     """
-#     host = os.getenv("HDC_SERVER_HOST")
-#     port = os.getenv("HDC_SERVER_PORT")
-#     if host and port:
-#         logger.debug(f"HDC_SERVER_HOST: {host}, HDC_SERVER_PORT: {port}")
-#         return f"hdc -s {host}:{port}"
-#     return "hdc"
-
-# async def list_devices() -> List[str]:
-#     devices = []
-#     hdc_prefix = _build_hdc_prefix()
-#     success, result = await _execute_command(f"{hdc_prefix} list targets")
-#     if success:
-#         lines = result.strip().split('\n')
-#         for line in lines:
-#             devices.append(line.strip())
-#         return devices
-
-#     return f"[Fail] {result}"
-
-
-
-if __name__ == "__main__":
-    asyncio.run(launch_package("com.huawei.hmos.browser"))
+import shlex
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+
+from . import logger
+from .client import parse_targets
+from .config import COMMAND_TIMEOUT, HDC_SERVER_HOST, HDC_SERVER_PORT, HDC_REMOTE_SERVER, SHELL_MODE
+from .execption import HdcError
+
+
+def _build_hdc_prefix(serial: Optional[str] = None) -> str:
+    """
+    Construct the hdc command prefix for a device, None for the only connected one.
+    """
+    prefix = "hdc"
+    if HDC_REMOTE_SERVER:
+        logger.debug(f"HDC_SERVER_HOST: {HDC_SERVER_HOST}, HDC_SERVER_PORT: {HDC_SERVER_PORT}")
+        prefix += f" -s {HDC_SERVER_HOST}:{HDC_SERVER_PORT}"
+    if serial:
+        prefix += f" -t {shlex.quote(serial)}"
+    return prefix
+
+
+@dataclass
+class Device:
+    serial: Optional[str]       # None addresses the only connected device
+    prefix: str                 # hdc command prefix, with -s and -t as needed
+
+
+_devices: Dict[Optional[str], Device] = {}
+
+# serial of the only connected device, looked up again after
+# RESOLVE_RETRY seconds while there is none or several
+RESOLVE_RETRY = 5.0
+_default_serial: Optional[str] = None
+_resolved_at: Optional[float] = None
+_resolving: Optional[asyncio.Future] = None
+
+
+def _set_default(targets: List[str]):
+    global _default_serial, _resolved_at
+    _default_serial = targets[0] if len(targets) == 1 else None
+    _resolved_at = time.monotonic()
+
+
+async def _list_targets() -> List[str]:
+    if SHELL_MODE == "native":
+        from .client import get_client
+        return await get_client().list_targets()
+    from .system import _spawn_command
+    # not addressed to any device
+    success, result = await _spawn_command(f"{_build_hdc_prefix()} list targets", COMMAND_TIMEOUT)
+    if not success:
+        raise HdcError(result)
+    return parse_targets(result)
+
+
+async def _lookup_default() -> Optional[str]:
+    global _resolving
+    try:
+        try:
+            targets = await _list_targets()
+        except (OSError, HdcError) as e:
+            logger.debug(f"fail to look up the connected device: {e}")
+            targets = []
+        _set_default(targets)
+        return _default_serial
+    finally:
+        _resolving = None
+
+
+async def resolve_default() -> Optional[str]:
+    """
+    The serial of the only connected device, looked up once while unknown;
+    concurrent callers share one lookup.
+    """
+    global _resolving
+    if _default_serial is not None or (_resolved_at is not None and time.monotonic() - _resolved_at <= RESOLVE_RETRY):
+        return _default_serial
+    if _resolving is None:
+        _resolving = asyncio.ensure_future(_lookup_default())
+    return await asyncio.shield(_resolving)
+
+
+def get_device(serial: Optional[str] = None) -> Device:
+    """
+    The device with `serial`, or the only connected one. Its `serial` is the
+    key of every per-device state, so omitting it and naming that device
+    explicitly address the same state once `resolve_default` or
+    `list_devices` found that device; this never waits for the lookup.
+    """
+    serial = serial or _default_serial
+    device = _devices.get(serial)
+    if device is None:
+        device = _devices[serial] = Device(serial, _build_hdc_prefix(serial))
+    return device
+
+
+def device_key(device: Optional[str] = None) -> Optional[str]:
+    return get_device(device).serial
+
+
+async def list_devices() -> Union[List[str], str]:
+    """
+    List the serials of the connected devices. Pass one of them as `device`
+    to the other tools to drive that device; without it they use the only
+    connected device.
+    """
+    try:
+        targets = await _list_targets()
+    except (OSError, HdcError) as e:
+        return f"[Fail] {e}"
+    _set_default(targets)
+    for serial in targets:
+        get_device(serial)
+    return targets
@@ -0,0 +1,166 @@
+"""
+    Iterative parser for uitest layout dumps
+    逐个产出组件节点, 不使用递归, 不构建完整的嵌套字典树
+
+    Backends, picked by what is installed:
+        ijson:  true streaming, nodes are produced while the text is tokenized
+        orjson: fast full parse followed by an iterative walk
+        json:   standard library fallback
+"""
+
+import io
+import json
+from typing import Dict, Iterator, NamedTuple, Union
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the system status bar, skipped together with its subtree
+SKIPPED_BUNDLES = ("com.ohos.sceneboard",)
+
+
+class LayoutNode(NamedTuple):
+    index: int          # pre-order index of the node
+    parent: int         # index of the parent node, -1 for the root
+    depth: int
+    attributes: Dict[str, str]
+
+
+def loads(raw: Union[str, bytes]):
+    """
+    Parse json with the fastest available backend.
+    """
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _json_start(raw: Union[str, bytes]) -> int:
+    # uitest may print a status line before the json document
+    return max(raw.find(b"{" if isinstance(raw, bytes) else "{"), 0)
+
+
+def _skipped(attributes: Dict[str, str]) -> bool:
+    return attributes.get("bundleName", "") in SKIPPED_BUNDLES
+
+
+def _walk(root: Dict) -> Iterator[LayoutNode]:
+    # explicit stack of (node, parent index, depth), children pushed in reverse
+    # so nodes come out in the same pre-order as a recursive traversal
+    stack = [(root, -1, 0)]
+    index = 0
+    while stack:
+        node, parent, depth = stack.pop()
+        attributes = node.get("attributes", {})
+        if parent != -1 and _skipped(attributes):
+            continue
+        yield LayoutNode(index, parent, depth, attributes)
+        children = node.get("children") or ()
+        for child in reversed(children):
+            stack.append((child, index, depth + 1))
+        index += 1
+
+
+class _Frame:
+    __slots__ = ("kind", "key", "index", "depth", "skip", "attributes")
+
+    def __init__(self, kind: str, index: int = -1, depth: int = 0, skip: bool = False):
+        self.kind = kind        # "node", "attributes", "children" or "other"
+        self.key = None
+        self.index = index
+        self.depth = depth
+        self.skip = skip
+        self.attributes = None
+
+
+def _stream(stream: io.BytesIO) -> Iterator[LayoutNode]:
+    """
+    Produce nodes from ijson tokens. A node is emitted as soon as its
+    `attributes` object is complete, which uitest always writes before
+    `children`.
+    """
+    stack = []
+    nodes = []      # enclosing node frames, innermost last
+    index = 0
+    for event, value in ijson.basic_parse(stream):
+        top = stack[-1] if stack else None
+        if event == "map_key":
+            top.key = value
+        elif event == "start_map":
+            if top is None or top.kind == "children":
+                parent = nodes[-1] if nodes else None
+                frame = _Frame("node",
+                               depth=parent.depth + 1 if parent else 0,
+                               skip=parent.skip if parent else False)
+                nodes.append(frame)
+            elif top.kind == "node" and top.key == "attributes":
+                frame = _Frame("attributes")
+                frame.attributes = {}
+            else:
+                frame = _Frame("other")
+            stack.append(frame)
+        elif event == "start_array":
+            kind = "children" if top.kind == "node" and top.key == "children" else "other"
+            stack.append(_Frame(kind))
+        elif event in ("end_map", "end_array"):
+            frame = stack.pop()
+            if frame.kind == "node":
+                nodes.pop()
+            elif frame.kind == "attributes":
+                node = nodes[-1]
+                parent = nodes[-2].index if len(nodes) > 1 else -1
+                if node.skip or (parent != -1 and _skipped(frame.attributes)):
+                    node.skip = True
+                    continue
+                node.index = index
+                index += 1
+                yield LayoutNode(node.index, parent, node.depth, frame.attributes)
+        elif top.kind == "attributes":
+            top.attributes[top.key] = value
+
+
+def iter_nodes(raw: Union[str, bytes, Dict]) -> Iterator[LayoutNode]:
+    """
+    Iterate over the nodes of a layout dump in pre-order.
+    `raw` may be the dump text or an already parsed tree.
+    """
+    if isinstance(raw, dict):
+        return _walk(raw)
+    start = _json_start(raw)
+    if ijson is not None:
+        if isinstance(raw, str):
+            raw = raw[start:].encode("utf-8")
+            start = 0
+        # BytesIO shares the buffer of `raw` instead of copying it
+        stream = io.BytesIO(raw)
+        stream.seek(start)
+        return _stream(stream)
+    return _walk(loads(raw[start:]))
+
+
+if __name__ == "__main__":
+    # measure parse time and peak memory of a saved dump:
+    #   python -m hdc.hierarchy layout.json
+    import sys
+    import time
+    import tracemalloc
+
+    with open(sys.argv[1], "rb") as fp:
+        data = fp.read()
+
+    tracemalloc.start()
+    begin = time.perf_counter()
+    count = sum(1 for _ in iter_nodes(data))
+    elapsed = time.perf_counter() - begin
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    backend = "ijson" if ijson else "orjson" if orjson else "json"
+    print(f"{backend}: {count} nodes, {elapsed * 1000:.1f} ms, peak {peak / 1024 / 1024:.1f} MiB")
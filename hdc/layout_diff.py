@@ -0,0 +1,112 @@
+"""
+    Diff between two consecutive layout dumps
+    匹配前后两次 dump 的组件, 找出新增/删除/移动/变化的组件
+"""
+
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from .proto import ElementInfo
+
+# a move listed on its own costs about this much of a full element listing
+MOVE_WEIGHT = 0.25
+
+
+@dataclass
+class LayoutDelta:
+    added: List[ElementInfo] = field(default_factory=list)
+    removed: List[ElementInfo] = field(default_factory=list)
+    moved: List[Tuple[ElementInfo, ElementInfo]] = field(default_factory=list)
+    changed: List[Tuple[ElementInfo, ElementInfo]] = field(default_factory=list)
+    unchanged: int = 0
+    # offset shared by the elements that moved together, e.g. by a scroll
+    shift: Optional[Tuple[int, int]] = None
+    shifted: int = 0
+
+    @property
+    def change_count(self) -> int:
+        return len(self.added) + len(self.removed) + len(self.moved) + len(self.changed)
+
+    def change_ratio(self) -> float:
+        """
+        How much of the full listing the delta repeats; shifted elements are
+        reported in one line and cost nothing.
+        """
+        total = self.change_count + self.unchanged + self.shifted
+        cost = len(self.added) + len(self.removed) + len(self.changed) + MOVE_WEIGHT * len(self.moved)
+        return cost / total if total else 0.0
+
+
+def identity(element: ElementInfo) -> tuple:
+    """
+    The key used to match an element between dumps: the developer-assigned
+    `key` or `id` when present, otherwise what the element shows.
+    """
+    if element.key:
+        return ("key", element.key)
+    if element.id:
+        return ("id", element.id)
+    return ("content", element.type, element.text, element.description)
+
+
+def _distance(a: ElementInfo, b: ElementInfo) -> int:
+    if a.boundsCenter is None or b.boundsCenter is None:
+        return 0
+    return abs(a.boundsCenter.x - b.boundsCenter.x) + abs(a.boundsCenter.y - b.boundsCenter.y)
+
+
+def _offset(old: ElementInfo, new: ElementInfo) -> Optional[Tuple[int, int]]:
+    """
+    How far the element moved, None if it was also resized.
+    """
+    a, b = old.bounds, new.bounds
+    if a is None or b is None or a.right - a.left != b.right - b.left or a.bottom - a.top != b.bottom - b.top:
+        return None
+    return b.left - a.left, b.top - a.top
+
+
+def _split_shift(delta: LayoutDelta):
+    """
+    Take the most common offset of several moved elements as a shift of
+    the content they belong to, leaving only the other moves listed.
+    """
+    offsets = Counter(offset for offset in (_offset(old, new) for old, new in delta.moved) if offset)
+    if not offsets:
+        return
+    shift, count = offsets.most_common(1)[0]
+    if count < 2:
+        return
+    delta.shift, delta.shifted = shift, count
+    delta.moved = [(old, new) for old, new in delta.moved if _offset(old, new) != shift]
+
+
+def diff_elements(old: List[ElementInfo], new: List[ElementInfo]) -> LayoutDelta:
+    """
+    Match elements by identity; among elements sharing an identity
+    (e.g. repeated list rows) the closest ones are paired first. Elements
+    moved by the same offset are counted as one shift.
+    """
+    delta = LayoutDelta()
+    old_groups: Dict[tuple, List[ElementInfo]] = defaultdict(list)
+    for element in old:
+        old_groups[identity(element)].append(element)
+
+    for element in new:
+        candidates = old_groups.get(identity(element))
+        if not candidates:
+            delta.added.append(element)
+            continue
+        previous = min(candidates, key=lambda candidate: _distance(candidate, element))
+        candidates.remove(previous)
+        if previous.bounds != element.bounds:
+            delta.moved.append((previous, element))
+        elif previous != element:
+            delta.changed.append((previous, element))
+        else:
+            delta.unchanged += 1
+
+    for candidates in old_groups.values():
+        delta.removed.extend(candidates)
+    _split_shift(delta)
+    return delta
@@ -5,47 +5,378 @@
     增大音量/减少音量/静音
 """
 
-import uuid
-from .system import _execute_command, recv_file, shell
+import asyncio
+import io
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+from .config import (SCREENSHOT_SCALE, SCREENSHOT_FORMAT, SCREENSHOT_QUALITY, SCREENSHOT_HASH_THRESHOLD,
+                     SCREENSHOT_TILE_SIZE, SCREENSHOT_DELTA_MAX_RATIO)
+from .capture import get_capture
+from .frame_buffer import Frame, FrameRecorder
+from .frame_diff import changed_tiles, tile_regions
+from .frame_hash import THUMBNAIL_SCALE, dhash, hamming, thumbnail
+from .hdc import device_key
+from .settle import settled_capture
+from .system import PRIORITY_BACKGROUND, _execute_command, shell
 from mcp.server.fastmcp import Image
 from PIL import Image as PILImage
-from .proto import KeyCode
+from .proto import Bounds, KeyCode
+from .utils import parse_bounds
+from .window_manager import interaction, interaction_epoch
 
 
-async def screenshot(path: str) -> str:
+async def screenshot(path: str, device: str = None) -> str:
     """
     take screenshot
     :param path: the local path for saving the screenshot
     """
-    _uuid = uuid.uuid4().hex
-    _tmp_path = f"/data/local/tmp/_tmp_{_uuid}.jpeg"
-    await _execute_command(f"hdc shell snapshot_display -f {_tmp_path}")
-    await recv_file(_tmp_path, path)
-    await _execute_command(f"hdc shell rm -rf {_tmp_path}")  # remove local path
+    data = await capture_screen(device)
+    with open(path, "wb") as f:
+        f.write(data)
     return path
 
 
-async def get_screenshot() -> Image:
+async def capture_screen(device: str = None, priority: int = None) -> bytes:
+    """
+    take a screenshot and return the encoded image without touching the local disk,
+    in a single device round trip
+    """
+    return await get_capture(device).screenshot(priority)
+
+
+Box = Tuple[int, int, int, int]
+
+
+def _save(img: PILImage.Image, fmt: str, quality: int) -> bytes:
+    output = io.BytesIO()
+    if fmt == "png":
+        img.save(output, "PNG", optimize=True)
+    else:
+        img.save(output, fmt.upper(), quality=quality)
+    return output.getvalue()
+
+
+def _encode_regions(data: bytes, boxes: List[Box], scale: float, fmt: str, quality: int) -> List[bytes]:
+    """
+    Crop regions, given in device pixels, out of one captured frame, then
+    scale and encode each of them. The frame is decoded only once. CPU bound,
+    run in an executor.
+    """
+    with PILImage.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        # let the JPEG decoder scale down by a power of two while decoding
+        img.draft("RGB", (max(1, int(width * scale)), max(1, int(height * scale))))
+        if img.mode not in ("RGB", "L") and fmt != "png":
+            img = img.convert("RGB")
+        img.load()
+        factor = img.size[0] / width
+        result = []
+        for left, top, right, bottom in boxes:
+            size = (max(1, int((right - left) * scale)), max(1, int((bottom - top) * scale)))
+            region = img
+            if (left, top, right, bottom) != (0, 0, width, height):
+                region = img.crop((int(left * factor), int(top * factor), int(right * factor), int(bottom * factor)))
+            result.append(_save(region.resize(size, PILImage.Resampling.LANCZOS), fmt, quality))
+    return result
+
+
+def _encode_screenshot(data: bytes, scale: float, fmt: str, quality: int) -> bytes:
+    """
+    Downscale and re-encode a whole captured frame.
+    """
+    with PILImage.open(io.BytesIO(data)) as img:
+        box = (0, 0, *img.size)
+    return _encode_regions(data, [box], scale, fmt, quality)[0]
+
+
+async def _encode(data: bytes) -> Image:
+    # compressing the ss to avoid "maximum call stack exceeded" error on claude desktop
+    encoded = await asyncio.get_running_loop().run_in_executor(
+        None, _encode_screenshot, data, SCREENSHOT_SCALE, SCREENSHOT_FORMAT, SCREENSHOT_QUALITY
+    )
+    return Image(data=encoded, format=SCREENSHOT_FORMAT)
+
+
+async def _encode_boxes(data: bytes, boxes: List[Box], scale: float = SCREENSHOT_SCALE) -> List[Image]:
+    encoded = await asyncio.get_running_loop().run_in_executor(
+        None, _encode_regions, data, boxes, scale, SCREENSHOT_FORMAT, SCREENSHOT_QUALITY
+    )
+    return [Image(data=item, format=SCREENSHOT_FORMAT) for item in encoded]
+
+
+@dataclass
+class ScreenCacheEntry:
+    seq: int                        # screenshot number at which this screen was first seen
+    hash: int                       # difference hash of the captured frame
+    timestamp: float
+    data: bytes                     # the frame as captured on the device
+    thumbnail: PILImage.Image       # grayscale copy used for hashing and tile comparison
+    image: Optional[Image] = None   # the downscaled full screen, encoded on first use
+
+
+# last distinct screen per device, None is the default device
+_screens: Dict[Optional[str], ScreenCacheEntry] = {}
+_screen_counter = 0
+
+# merge changed regions into one when there are more than this many
+DELTA_MAX_REGIONS = 4
+
+
+def _tile() -> int:
+    # tile size in thumbnail pixels
+    return max(1, SCREENSHOT_TILE_SIZE // THUMBNAIL_SCALE)
+
+
+def _same_screen(last: ScreenCacheEntry, small: PILImage.Image, frame_hash: int) -> bool:
+    """
+    The hash alone misses small changes on plain backgrounds (a typed
+    character), so a matching hash is confirmed on the thumbnails.
+    """
+    return (SCREENSHOT_HASH_THRESHOLD >= 0 and hamming(last.hash, frame_hash) <= SCREENSHOT_HASH_THRESHOLD
+            and changed_tiles(last.thumbnail, small, _tile()) == set())
+
+
+def _analyze(data: bytes) -> Tuple[PILImage.Image, int]:
+    small = thumbnail(data)
+    return small, dhash(small)
+
+
+async def _screen(data: bytes, device: str = None) -> Tuple[ScreenCacheEntry, Optional[ScreenCacheEntry]]:
+    """
+    Hash a captured frame and compare it with the last screen of the device.
+    Returns the entry of the current screen and the one it replaced; both
+    are the same entry when the screen did not change.
+    """
+    global _screen_counter
+    small, frame_hash = await asyncio.get_running_loop().run_in_executor(None, _analyze, data)
+    _screen_counter += 1
+    last = _screens.get(device_key(device))
+    if last is not None and _same_screen(last, small, frame_hash):
+        return last, last
+    entry = _screens[device_key(device)] = ScreenCacheEntry(_screen_counter, frame_hash, time.time(), data, small)
+    return entry, last
+
+
+async def _full_image(entry: ScreenCacheEntry) -> Image:
+    if entry.image is None:
+        entry.image = await _encode(entry.data)
+    return entry.image
+
+
+def _changed_boxes(old: ScreenCacheEntry, new: ScreenCacheEntry) -> Optional[List[Box]]:
+    """
+    Changed regions of `new` in device pixels, None if they cover too much
+    of the screen for a delta to pay off.
+    """
+    tile = _tile()
+    tiles = changed_tiles(old.thumbnail, new.thumbnail, tile)
+    if tiles is None:
+        return None
+    columns, rows = (-(-side // tile) for side in new.thumbnail.size)
+    if len(tiles) > SCREENSHOT_DELTA_MAX_RATIO * columns * rows:
+        return None
+    regions = tile_regions(tiles)
+    if len(regions) > DELTA_MAX_REGIONS:
+        regions = [(min(r[0] for r in regions), min(r[1] for r in regions),
+                    max(r[2] for r in regions), max(r[3] for r in regions))]
+    with PILImage.open(io.BytesIO(new.data)) as img:
+        width, height = img.size
+    # thumbnail tiles to device pixels
+    fx = width / new.thumbnail.size[0] * tile
+    fy = height / new.thumbnail.size[1] * tile
+    return [(int(l * fx), int(t * fy), min(width, int(r * fx)), min(height, int(b * fy)))
+            for l, t, r, b in regions]
+
+
+async def _delta(old: ScreenCacheEntry, new: ScreenCacheEntry) -> Union[list, str, None]:
+    boxes = await asyncio.get_running_loop().run_in_executor(None, _changed_boxes, old, new)
+    if boxes is None:
+        return None
+    if not boxes:
+        # the hash moved, but no tile changed beyond the pixel threshold
+        return f"screen unchanged since frame #{old.seq}"
+    result: list = [f"screen changed since frame #{old.seq} in {len(boxes)} region(s), "
+                    f"each image below is the region at the given bounds"]
+    for box, image in zip(boxes, await _encode_boxes(new.data, boxes)):
+        result.append("region [{},{}][{},{}]".format(*box))
+        result.append(image)
+    return result
+
+
+# background recorders per device
+_recorders: Dict[Optional[str], FrameRecorder] = {}
+
+
+def _recorder(device: str = None) -> Optional[FrameRecorder]:
+    recorder = _recorders.get(device_key(device))
+    return recorder if recorder is not None and recorder.running else None
+
+
+async def _current_frame(device: str = None) -> Optional[Frame]:
+    """
+    The latest recorded frame if background recording is on and no
+    interaction happened since it was captured, else wait for a fresh one.
+    """
+    recorder = _recorder(device)
+    if recorder is None:
+        return None
+    frame = recorder.latest()
+    if frame is not None and frame.epoch == interaction_epoch(device):
+        return frame
+    return await recorder.wait_for_frame(newer_than=time.time())
+
+
+async def _latest_screen(device: str = None) -> bytes:
+    frame = await _current_frame(device)
+    if frame is not None:
+        return frame.data
+    # the frame the settle wait ended on is still the current screen
+    return settled_capture(device, "screen") or await capture_screen(device)
+
+
+async def get_screenshot(only_changes: bool = False, delta: bool = False,
+                         device: str = None) -> Union[Image, str, list]:
     """Takes a screenshot of the device and returns it.
+    Args:
+        only_changes: return a short text instead of the image when the screen
+            looks the same as in the previous screenshot
+        delta: return only the regions that changed since the previous
+            screenshot, with their bounds; the full screen is returned when
+            most of it changed
+        device: serial from `list_devices`, omit it for the only connected device
     Returns:
         Image: the screenshot
     """
-    path = await screenshot("screenshot.png")
-    # compressing the ss to avoid "maximum call stack exceeded" error on claude desktop
-    with PILImage.open(path) as img:
+    entry, previous = await _screen(await _latest_screen(device), device)
+    if entry is previous and (only_changes or delta):
+        return f"screen unchanged since frame #{entry.seq}"
+    if delta and previous is not None:
+        regions = await _delta(previous, entry)
+        if regions is not None:
+            return regions
+    return await _full_image(entry)
+
+
+async def get_screen_hash(device: str = None) -> str:
+    """
+    Perceptual hash of the current screen, cheaper than a screenshot.
+    Poll it after an action: the UI has settled once the hash stops changing.
+    Args:
+        device: serial from `list_devices`, omit it for the only connected device
+    Returns:
+        the 256 bit difference hash in hex, and whether it matches the last screenshot
+    """
+    small, frame_hash = await asyncio.get_running_loop().run_in_executor(None, _analyze, await _latest_screen(device))
+    last = _screens.get(device_key(device))
+    if last is not None and _same_screen(last, small, frame_hash):
+        return f"{frame_hash:064x} (unchanged since frame #{last.seq})"
+    return f"{frame_hash:064x}"
+
+
+_RECT_PATTERN = re.compile(r"^\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*$")
+
+
+def _parse_region(region: str) -> Optional[Bounds]:
+    match = _RECT_PATTERN.match(region)
+    if match:
+        return Bounds(*(int(value) for value in match.groups()))
+    return parse_bounds(region.strip())
+
+
+async def get_screen_regions(regions: List[str], scale: float = 1.0, device: str = None) -> list:
+    """
+    Capture parts of the screen at full resolution, e.g. to read small text,
+    instead of a downscaled screenshot of the whole screen. All regions are
+    cut from one capture.
+    Args:
+        regions: element bounds as printed by `get_uilayout`, like "[832,1282][1125,1412]",
+            or rectangles "left,top,right,bottom" in device pixels
+        scale: scale factor of the returned images, 1 keeps the device resolution
+        device: serial from `list_devices`, omit it for the only connected device
+    Returns:
+        the bounds of each region followed by its image
+    """
+    boxes = []
+    for region in regions:
+        bounds = _parse_region(region)
+        if bounds is None or bounds.right <= bounds.left or bounds.bottom <= bounds.top:
+            return [f"[Fail] invalid region: {region}"]
+        boxes.append((bounds.left, bounds.top, bounds.right, bounds.bottom))
+    if not boxes:
+        return ["[Fail] no region given"]
+
+    data = await _latest_screen(device)
+    with PILImage.open(io.BytesIO(data)) as img:
         width, height = img.size
-        new_width = int(width * 0.3)
-        new_height = int(height * 0.3)
-        resized_img = img.resize(
-            (new_width, new_height), PILImage.Resampling.LANCZOS
-        )
-        resized_img.save(
-            "compressed_screenshot.png", "PNG", quality=85, optimize=True
-        )
-    return Image("compressed_screenshot.png")
+    clipped = [(max(0, l), max(0, t), min(width, r), min(height, b)) for l, t, r, b in boxes]
+    for region, (l, t, r, b) in zip(regions, clipped):
+        if r <= l or b <= t:
+            return [f"[Fail] region {region} is outside the screen ({width}x{height})"]
+
+    result = []
+    for box, image in zip(clipped, await _encode_boxes(data, clipped, scale)):
+        result.append("region [{},{}][{},{}]".format(*box))
+        result.append(image)
+    return result
+
+
+async def start_screen_recording(fps: float = 2.0, buffer_size: int = 8, device: str = None) -> str:
+    """
+    Start capturing the screen in the background, so `get_screenshot`
+    returns the latest frame immediately. The rate drops automatically
+    while nobody asks for frames.
+    Args:
+        fps: frames per second while frames are being read
+        buffer_size: number of recent frames kept in memory
+        device: serial from `list_devices`, omit it for the only connected device
+    """
+    device = device_key(device)
+    if device in _recorders:
+        await _recorders.pop(device).stop()
+    recorder = _recorders[device] = FrameRecorder(
+        lambda: capture_screen(device, PRIORITY_BACKGROUND), lambda: interaction_epoch(device), fps=fps, buffer_size=buffer_size
+    )
+    recorder.start()
+    return f"[Success] recording the screen at {fps} fps"
+
+
+async def stop_screen_recording(device: str = None) -> str:
+    """
+    Stop the background screen capture started by `start_screen_recording`.
+    Args:
+        device: serial from `list_devices`, omit it for the only connected device
+    """
+    device = device_key(device)
+    if device not in _recorders:
+        return "[Fail] the screen is not being recorded"
+    await _recorders.pop(device).stop()
+    return "[Success] screen recording stopped"
+
+
+async def wait_for_screen_frame(newer_than: float = 0, timeout: float = 5.0, device: str = None) -> list:
+    """
+    Wait for a recorded frame captured after the given time.
+    Args:
+        newer_than: unix timestamp, e.g. the timestamp of the last frame seen
+        timeout: seconds to wait at most
+        device: serial from `list_devices`, omit it for the only connected device
+    Returns:
+        the frame number and timestamp, followed by the image
+    """
+    recorder = _recorder(device)
+    if recorder is None:
+        return ["[Fail] the screen is not being recorded, call `start_screen_recording` first"]
+    frame = await recorder.wait_for_frame(newer_than, timeout=timeout)
+    if frame is None:
+        return [f"[Fail] no new frame within {timeout} seconds"]
+    entry, _ = await _screen(frame.data, device)
+    return [f"frame #{frame.seq} captured at {frame.timestamp:.3f}", await _full_image(entry)]
 
 
-async def media_play_pause() -> str:
+@interaction
+async def media_play_pause(device: str = None) -> str:
     """
     Play or pause media on the phone.
 
@@ -57,67 +388,72 @@ async def media_play_pause() -> str:
              if the command failed.
     """
     Keycode = KeyCode.MEDIA_PLAY_PAUSE.value
-    success, res = await _execute_command(f"hdc shell uitest uiInput keyEvent {Keycode}")
+    success, res = await _execute_command(f"hdc shell uitest uiInput keyEvent {Keycode}", device=device)
     if success:
         return f"Media play/pause command sent successfully"
     else:
         return f"Failed to control media: {res}"
 
 
-async def media_next() -> str:
+@interaction
+async def media_next(device: str = None) -> str:
     """
     play the next media
     """
     Keycode = KeyCode.MEDIA_NEXT.value
-    success, res = await _execute_command(f"hdc shell uitest uiInput keyEvent {Keycode}")
+    success, res = await _execute_command(f"hdc shell uitest uiInput keyEvent {Keycode}", device=device)
     if success:
         return "next media command sent successfully"
     else:
         return f"Failed to control media: {res}"
 
 
-async def media_previous() -> str:
+@interaction
+async def media_previous(device: str = None) -> str:
     """
     play the previous media
     """
     Keycode = KeyCode.MEDIA_PREVIOUS.value
-    success, res = await _execute_command(f"hdc shell uitest uiInput keyEvent {Keycode}")
+    success, res = await _execute_command(f"hdc shell uitest uiInput keyEvent {Keycode}", device=device)
     if success:
         return "next previous command sent successfully"
     else:
         return f"Failed to control media: {res}"
 
 
-async def volume_up() -> str:
+@interaction
+async def volume_up(device: str = None) -> str:
     """
     turn up the volume
     """
     Keycode = KeyCode.VOLUME_UP.value
-    success, res = await _execute_command(f"hdc shell uitest uiInput keyEvent {Keycode}")
+    success, res = await _execute_command(f"hdc shell uitest uiInput keyEvent {Keycode}", device=device)
     if success:
         return "Volume up command sent successfully"
     else:
         return f"Failed to control media: {res}"
     
 
-async def volume_down() -> str:
+@interaction
+async def volume_down(device: str = None) -> str:
     """
     turn down the volume
     """
     Keycode = KeyCode.VOLUME_DOWN.value
-    success, res = await _execute_command(f"hdc shell uitest uiInput keyEvent {Keycode}")
+    success, res = await _execute_command(f"hdc shell uitest uiInput keyEvent {Keycode}", device=device)
     if success:
         return "Volume down command sent successfully"
     else:
         return f"Failed to control media: {res}"
 
 
-async def volume_mute() -> str:
+@interaction
+async def volume_mute(device: str = None) -> str:
     """
     mute the volume
     """
     Keycode = KeyCode.VOLUME_MUTE.value
-    success, res = await _execute_command(f"hdc shell uitest uiInput keyEvent {Keycode}")
+    success, res = await _execute_command(f"hdc shell uitest uiInput keyEvent {Keycode}", device=device)
     if success:
         return "Volume mute command sent successfully"
     else:
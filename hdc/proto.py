@@ -83,6 +83,11 @@ class ComponentData:
     value: str  # "Component#0"
 
 
+@dataclass
+class PointerMatrixData:
+    value: str  # "PointerMatrix#0"
+
+
 @dataclass
 class Point:
     x: int
@@ -0,0 +1,126 @@
+"""
+    Stand-in hdc server replaying recorded frames
+    录制: 作为代理转发到真实 hdc server, 按命令记录返回的数据包;
+    回放: 不连接设备, 按命令原样返回录制的数据包, 用于测试 HdcClient
+"""
+
+import asyncio
+import base64
+import json
+import re
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from . import logger
+from .client import BANNER_SIZE, CONNECT_KEY_SIZE, HANDSHAKE_BANNER, pack_packet, read_packet
+
+# the random part of the exit code marker of `HdcClient.shell`
+_TOKEN_PATTERN = re.compile(r"(?<=HDCRC)(\"\")?[0-9a-f]{16}")
+_TOKEN_PLACEHOLDER = "{token}"
+
+
+def _split_token(command: str) -> Tuple[str, Optional[str]]:
+    """
+    The command with its marker token replaced by a placeholder, and the token.
+    """
+    match = _TOKEN_PATTERN.search(command)
+    if match is None:
+        return command, None
+    token = match.group(0)[-16:]
+    return command.replace(token, _TOKEN_PLACEHOLDER), token
+
+
+class ReplayServer:
+    """
+    Speak the server side of the hdc channel protocol.
+
+    With an `upstream` (host, port) every channel is forwarded to the real
+    server and the packets it sends back are recorded per command. Without
+    one the recorded packets are replayed; unknown commands get an empty
+    answer and are logged.
+    """
+
+    def __init__(self, recording: Dict[str, List[bytes]] = None,
+                 upstream: Tuple[str, int] = None, handshake: bytes = None):
+        self.recording: Dict[str, List[bytes]] = recording if recording is not None else {}
+        self.upstream = upstream
+        self.handshake = handshake or (HANDSHAKE_BANNER.ljust(BANNER_SIZE, b"\0")
+                                       + b"\0" * CONNECT_KEY_SIZE + struct.pack(">I", 1))
+        # (connect key, command) of every channel served, in order
+        self.requests: List[Tuple[str, str]] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self._server = await asyncio.start_server(self._serve, host, port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            if self.upstream is None:
+                await self._replay(reader, writer)
+            else:
+                await self._record(reader, writer)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            logger.debug(f"replay channel closed: {e}")
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[bytes, str]:
+        handshake = await read_packet(reader)
+        connect_key = handshake[BANNER_SIZE:BANNER_SIZE + CONNECT_KEY_SIZE].rstrip(b"\0").decode("utf-8")
+        command = (await read_packet(reader)).rstrip(b"\0").decode("utf-8")
+        self.requests.append((connect_key, command))
+        return handshake, command
+
+    async def _replay(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(pack_packet(self.handshake))
+        await writer.drain()
+        _, command = await self._read_request(reader)
+        key, token = _split_token(command)
+        if key not in self.recording:
+            logger.warning(f"no recorded answer for {key!r}")
+        for packet in self.recording.get(key, []):
+            if token is not None:
+                packet = packet.replace(_TOKEN_PLACEHOLDER.encode(), token.encode())
+            writer.write(pack_packet(packet))
+        await writer.drain()
+
+    async def _record(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        up_reader, up_writer = await asyncio.open_connection(*self.upstream)
+        try:
+            writer.write(pack_packet(await read_packet(up_reader)))
+            await writer.drain()
+            handshake, command = await self._read_request(reader)
+            up_writer.write(pack_packet(handshake) + pack_packet(command.encode("utf-8") + b"\0"))
+            await up_writer.drain()
+            key, token = _split_token(command)
+            packets = []
+            while packet := await read_packet(up_reader):
+                writer.write(pack_packet(packet))
+                if token is not None:
+                    packet = packet.replace(token.encode(), _TOKEN_PLACEHOLDER.encode())
+                packets.append(packet)
+            await writer.drain()
+            self.recording[key] = packets
+        finally:
+            up_writer.close()
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({command: [base64.b64encode(p).decode("ascii") for p in packets]
+                       for command, packets in self.recording.items()}, f, indent=2, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "ReplayServer":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls({command: [base64.b64decode(p) for p in packets] for command, packets in data.items()})
@@ -0,0 +1,108 @@
+"""
+    Element selector engine over a layout dump
+    为每次 dump 建立一次倒排索引, 按文本/key/类型/描述/状态/祖先 查找组件
+"""
+
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+from .Component import NodeStore
+from .proto import ElementInfo
+
+# boolean attributes that can be used as selector flags
+FLAGS = NodeStore.FLAGS
+
+
+@dataclass
+class Selector:
+    """
+    All given conditions must hold. `text`, `key`, `type` and `description`
+    match exactly, `text_regex` is searched in the text, flags left as None
+    are ignored and `ancestor` must match one of the node's ancestors.
+    """
+    text: Optional[str] = None
+    text_regex: Optional[str] = None
+    key: Optional[str] = None
+    type: Optional[str] = None
+    description: Optional[str] = None
+    clickable: Optional[bool] = None
+    scrollable: Optional[bool] = None
+    enabled: Optional[bool] = None
+    selected: Optional[bool] = None
+    checked: Optional[bool] = None
+    ancestor: Optional["Selector"] = None
+
+    def is_empty(self) -> bool:
+        return all(value is None for value in vars(self).values())
+
+
+class LayoutIndex:
+    """
+    Inverted indexes on the attributes of a `NodeStore`, from interned
+    string id to the nodes having that value.
+    """
+
+    INDEXED = ("text", "key", "type", "description")
+
+    def __init__(self, store: NodeStore):
+        self.store = store
+        self._index: Dict[str, Dict[int, List[int]]] = {}
+        for name in self.INDEXED:
+            postings = defaultdict(list)
+            for node, string_id in enumerate(store.columns.get(name, ())):
+                if string_id:
+                    postings[string_id].append(node)
+            self._index[name] = postings
+        self._flags: Dict[str, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def element(self, index: int) -> ElementInfo:
+        return self.store.element(index)
+
+    def _flag_set(self, name: str) -> Set[int]:
+        if name not in self._flags:
+            mask = self.store.flag_mask(name)
+            self._flags[name] = {i for i, flags in enumerate(self.store.flags) if flags & mask}
+        return self._flags[name]
+
+    def _candidates(self, selector: Selector) -> Set[int]:
+        sets = []
+        for name in self.INDEXED:
+            value = getattr(selector, name)
+            if value is not None:
+                string_id = self.store.string_id(value)
+                sets.append(self._index[name].get(string_id, ()))
+        for name in FLAGS:
+            if getattr(selector, name, None) is True:
+                sets.append(self._flag_set(name))
+        if not sets:
+            return set(range(len(self)))
+        # intersect starting from the smallest set
+        sets.sort(key=len)
+        result = set(sets[0])
+        for other in sets[1:]:
+            result.intersection_update(other)
+        return result
+
+    def _match_set(self, selector: Selector) -> Set[int]:
+        result = self._candidates(selector)
+        for name in FLAGS:
+            if getattr(selector, name, None) is False:
+                result -= self._flag_set(name)
+        if selector.text_regex is not None:
+            pattern = re.compile(selector.text_regex)
+            result = {i for i in result if pattern.search(self.store.attr(i, "text"))}
+        if selector.ancestor is not None:
+            ancestors = self._match_set(selector.ancestor)
+            result = {i for i in result if any(a in ancestors for a in self.store.ancestors(i))}
+        return result
+
+    def find(self, selector: Selector) -> List[int]:
+        """
+        Indexes of the matching nodes in document order.
+        """
+        return sorted(self._match_set(selector))
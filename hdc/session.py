@@ -0,0 +1,157 @@
+"""
+    Persistent `hdc shell` session
+    复用同一个 hdc shell 进程执行多条命令, 避免每条命令都重新启动 hdc
+"""
+
+import asyncio
+import shlex
+import subprocess
+import uuid
+from typing import Dict, Tuple
+
+from . import logger
+from .execption import SessionSpawnError
+from .proto import CommandResult
+
+_READ_SIZE = 64 * 1024
+# seconds a closing session gets to remove its stderr file and exit
+_CLOSE_TIMEOUT = 2.0
+
+
+class ShellSession:
+    """
+    A long-lived `hdc shell` process that executes commands one after another.
+
+    Every command is wrapped in a small script that prints a begin marker,
+    runs the command with its stderr redirected to a file on the device and
+    then prints an end marker carrying the exit code, followed by the captured
+    stderr and a final marker. The markers are built from two quoted halves,
+    so a terminal echoing the script back never matches them.
+    """
+
+    def __init__(self, prefix: str = "hdc"):
+        self._prefix = prefix
+        self._process: asyncio.subprocess.Process = None
+        self._lock = asyncio.Lock()
+        self._err_path = f"/data/local/tmp/.hdc_session_{uuid.uuid4().hex}.err"
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.returncode is None
+
+    async def _spawn(self):
+        logger.debug(f"spawning shell session: {self._prefix} shell")
+        self._process = await asyncio.create_subprocess_exec(
+            *shlex.split(self._prefix), "shell",
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+
+    async def _kill(self):
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        process.stdin.close()
+        await process.wait()
+
+    def _build_script(self, cmd: str, token: str) -> bytes:
+        script = (
+            f"printf '%s\\n' \"HDCBEGIN\"\"{token}\"; "
+            f"{{ {cmd}\n}} </dev/null 2>{self._err_path}; __rc=$?; "
+            f"printf '\\n%s %d\\n' \"HDCEND\"\"{token}\" $__rc; "
+            f"cat {self._err_path} 2>/dev/null; "
+            f"printf '\\n%s\\n' \"HDCERR\"\"{token}\"\n"
+        )
+        return script.encode("utf-8")
+
+    async def _read_frame(self, token: str) -> bytes:
+        marker = f"HDCERR{token}".encode()
+        buffer = bytearray()
+        while True:
+            chunk = await self._process.stdout.read(_READ_SIZE)
+            if not chunk:
+                raise ConnectionError("hdc shell session closed unexpectedly")
+            # only the tail can contain a marker that was split between reads
+            search_from = max(0, len(buffer) - len(marker))
+            buffer.extend(chunk)
+            if buffer.find(marker, search_from) != -1:
+                return bytes(buffer)
+
+    @staticmethod
+    def _parse_frame(raw: bytes, token: str) -> CommandResult:
+        text = raw.decode("utf-8", errors="replace").replace("\r\n", "\n")
+        begin = f"HDCBEGIN{token}\n"
+        end = f"\nHDCEND{token} "
+        err = f"\nHDCERR{token}"
+
+        start = text.find(begin) + len(begin)
+        stop = text.find(end, start)
+        status_end = text.find("\n", stop + len(end))
+        exit_code = int(text[stop + len(end):status_end])
+        error = text[status_end + 1:text.find(err, status_end)]
+        return CommandResult(output=text[start:stop], error=error, exit_code=exit_code)
+
+    async def execute(self, cmd: str, timeout: float = None) -> CommandResult:
+        """
+        Run `cmd` in the session shell, respawning the session if it died.
+        Raises `asyncio.TimeoutError` if the command does not finish in time,
+        in which case the session is killed and respawned on the next call.
+        Raises `SessionSpawnError` if no session could be started; nothing
+        was sent to the device then, so the command may be run another way.
+        """
+        async with self._lock:
+            if not self.alive:
+                try:
+                    await self._spawn()
+                except OSError as e:
+                    raise SessionSpawnError(f"failed to start hdc shell session: {e}") from e
+            token = uuid.uuid4().hex[:16]
+            try:
+                self._process.stdin.write(self._build_script(cmd, token))
+                await self._process.stdin.drain()
+                raw = await asyncio.wait_for(self._read_frame(token), timeout=timeout)
+            except BaseException:
+                # the shell is in an unknown state, start over next time
+                await self._kill()
+                raise
+            return self._parse_frame(raw, token)
+
+    async def close(self):
+        """
+        Remove the stderr file from the device and end the session.
+        """
+        async with self._lock:
+            if self.alive:
+                try:
+                    self._process.stdin.write(f"rm -f {self._err_path}; exit\n".encode("utf-8"))
+                    await self._process.stdin.drain()
+                    await asyncio.wait_for(self._process.wait(), timeout=_CLOSE_TIMEOUT)
+                except (OSError, asyncio.TimeoutError) as e:
+                    logger.debug(f"shell session did not exit cleanly: {e}")
+            await self._kill()
+
+
+_sessions: Dict[Tuple[str, int], ShellSession] = {}
+
+
+def get_session(prefix: str = "hdc", slot: int = 0) -> ShellSession:
+    """
+    Get the shell session for the given hdc prefix. A device has one session
+    per concurrency slot, so commands running in parallel on it do not queue
+    behind each other; sessions are spawned on first use.
+    """
+    key = (prefix, slot)
+    if key not in _sessions:
+        _sessions[key] = ShellSession(prefix)
+    return _sessions[key]
+
+
+async def close_sessions():
+    for session in list(_sessions.values()):
+        await session.close()
+    _sessions.clear()
@@ -0,0 +1,132 @@
+"""
+    Adaptive UI settle detection
+    操作之后轮询屏幕 (或组件树) 直到画面稳定, 以退避间隔轮询并限制最长等待时间,
+    取代固定的 0.6 秒等待; 稳定后的最后一帧留给紧接着的截图/dump 复用
+"""
+
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from . import logger
+from .capture import get_capture
+from .execption import HdcError
+from .config import SETTLE_SIGNAL, SETTLE_MAX_WAIT, SETTLE_INTERVAL, SCREENSHOT_TILE_SIZE
+from .frame_diff import changed_tiles
+from .frame_hash import THUMBNAIL_SCALE, thumbnail
+from .hdc import device_key
+
+# polling interval growth and bound
+BACKOFF = 1.5
+MAX_INTERVAL = 0.5
+# seconds the last probe of a settled UI stands in for a new capture
+CAPTURE_REUSE_MAX_AGE = 2.0
+
+
+@dataclass
+class SettleResult:
+    settled: bool       # False if the UI was still changing at the deadline
+    elapsed: float      # seconds from the start of the wait
+    polls: int          # number of probes taken
+
+    def __str__(self) -> str:
+        if self.settled:
+            return f"UI settled after {self.elapsed:.2f}s ({self.polls} polls)"
+        return f"UI still changing after {self.elapsed:.2f}s ({self.polls} polls)"
+
+
+async def wait_until_stable(probe: Callable[[], Awaitable[Any]], same: Callable[[Any, Any], bool],
+                            max_wait: float = SETTLE_MAX_WAIT,
+                            interval: float = SETTLE_INTERVAL) -> SettleResult:
+    """
+    Probe until two consecutive probes are the same, sleeping `interval`
+    between them and growing it by BACKOFF up to MAX_INTERVAL, for at most
+    `max_wait` seconds.
+    """
+    start = time.monotonic()
+    # give transitions a moment to start before the first probe
+    await asyncio.sleep(interval)
+    previous = await probe()
+    polls = 1
+    while True:
+        remaining = max_wait - (time.monotonic() - start)
+        if remaining <= 0:
+            return SettleResult(False, time.monotonic() - start, polls)
+        await asyncio.sleep(min(interval, remaining))
+        current = await probe()
+        polls += 1
+        if same(previous, current):
+            return SettleResult(True, time.monotonic() - start, polls)
+        previous = current
+        interval = min(interval * BACKOFF, MAX_INTERVAL)
+
+
+def _screen_probe(device: str, captured: Dict[str, Any]) -> Callable[[], Awaitable[Any]]:
+    async def probe():
+        data = captured["screen"] = await get_capture(device).screenshot()
+        return await asyncio.get_running_loop().run_in_executor(None, thumbnail, data)
+    return probe
+
+
+def _same_screen(a, b) -> bool:
+    return changed_tiles(a, b, max(1, SCREENSHOT_TILE_SIZE // THUMBNAIL_SCALE)) == set()
+
+
+def _layout_probe(device: str, captured: Dict[str, Any]) -> Callable[[], Awaitable[Any]]:
+    async def probe():
+        raw = captured["layout"] = await get_capture(device).layout()
+        return hashlib.blake2b(raw.encode("utf-8")).digest()
+    return probe
+
+
+@dataclass
+class SettledCapture:
+    signal: str         # "screen" or "layout"
+    timestamp: float    # time.monotonic() of the last probe
+    data: Any           # screenshot bytes or raw layout dump
+
+
+# last probe of a settled UI per device, dropped by the next interaction
+_captures: Dict[Optional[str], SettledCapture] = {}
+
+
+async def settle(device: str = None, max_wait: float = SETTLE_MAX_WAIT,
+                 signal: str = SETTLE_SIGNAL) -> Optional[SettleResult]:
+    """
+    Wait until the UI of the device is stable, watching the screen or the
+    layout depending on `signal`; None if settle detection is turned off or
+    failed.
+    """
+    captured: Dict[str, Any] = {}
+    try:
+        if signal == "screen":
+            result = await wait_until_stable(_screen_probe(device, captured), _same_screen, max_wait)
+        elif signal == "layout":
+            result = await wait_until_stable(_layout_probe(device, captured), lambda a, b: a == b, max_wait)
+        else:
+            return None
+    except (OSError, HdcError) as e:
+        # the action itself went through, only the wait is skipped
+        logger.warning(f"settle detection failed: {e}")
+        return None
+    if result.settled:
+        _captures[device_key(device)] = SettledCapture(signal, time.monotonic(), captured[signal])
+    return result
+
+
+def forget_capture(device: str = None):
+    _captures.pop(device_key(device), None)
+
+
+def settled_capture(device: str = None, signal: str = "screen") -> Any:
+    """
+    The last screenshot or layout dump taken while waiting for the UI to
+    settle, if no interaction happened since and it is recent; else None.
+    """
+    capture = _captures.get(device_key(device))
+    if (capture is None or capture.signal != signal
+            or time.monotonic() - capture.timestamp > CAPTURE_REUSE_MAX_AGE):
+        return None
+    return capture.data
@@ -0,0 +1,185 @@
+"""
+    Spatial index over the nodes of a layout dump
+    网格索引, 支持点查询 (坐标处最上层的组件)、矩形查询和遮挡判断
+"""
+
+from array import array
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from .Component import NodeStore
+
+CELL_SIZE = 256
+
+
+def _float(value: str, default: float) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+def _window_layer(window: str) -> int:
+    # window ids are handed out in creation order, newer windows usually on top
+    return int(window) if window.isdigit() else -1
+
+
+def _is_opaque_color(color: str) -> bool:
+    # colors are "#AARRGGBB" or "#RRGGBB"
+    if len(color) == 9 and color.startswith("#"):
+        return color[1:3].lower() == "ff"
+    return len(color) == 7 and color.startswith("#")
+
+
+class SpatialIndex:
+    """
+    Grid of the visible nodes of a `NodeStore`.
+
+    Every node belongs to the window of its nearest `hostWindowId`. Nodes
+    are ranked in paint order: a parent before its children and siblings by
+    window, `zIndex`, then document order. A node is visible when it and all
+    its ancestors have a positive opacity and it has a non-empty area; a
+    parent does not clip its children, so an empty wrapper hides nothing. It is
+    occluded when a later painted, opaque node of the same window outside
+    its own subtree and ancestry fully covers it; the dump does not tell how
+    windows are stacked, so a node is never hidden by another window.
+    """
+
+    def __init__(self, store: NodeStore, cell_size: int = CELL_SIZE):
+        self.store = store
+        self.cell_size = cell_size
+        size = len(store)
+        self.rank = array("i", bytes(4 * size))
+        self.subtree_end = array("i", range(size))
+        self.visible = bytearray(size)
+        # a node or ancestor has no opacity
+        self.transparent = bytearray(size)
+        self.opaque = bytearray(size)
+        self.window = array("i", bytes(4 * size))
+        self._grid: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self._occluded: Optional[Set[int]] = None
+
+        # pre-order indexes make subtrees contiguous ranges
+        for index in range(size - 1, 0, -1):
+            parent = store.parents[index]
+            if parent != -1 and self.subtree_end[index] > self.subtree_end[parent]:
+                self.subtree_end[parent] = self.subtree_end[index]
+
+        column = store.columns.get("hostWindowId")
+        if column is not None:
+            for index in range(size):
+                parent = store.parents[index]
+                self.window[index] = column[index] or (self.window[parent] if parent != -1 else 0)
+        self._rank_nodes()
+        for index in range(size):
+            self._insert(index)
+        # topmost first, so point queries can stop at the first hit
+        for cell in self._grid.values():
+            cell.sort(key=self.rank.__getitem__, reverse=True)
+
+    def _rank_nodes(self):
+        store = self.store
+        roots = [i for i in range(len(store)) if store.parents[i] == -1]
+        stack = list(reversed(roots))
+        rank = 0
+        while stack:
+            index = stack.pop()
+            self.rank[index] = rank
+            rank += 1
+            children = sorted(store.children(index),
+                              key=lambda child: (_window_layer(store.strings[self.window[child]]),
+                                                 _float(store.attr(child, "zIndex"), 0.0), child))
+            stack.extend(reversed(children))
+
+    def _insert(self, index: int):
+        store = self.store
+        parent = store.parents[index]
+        bounds = store.get_bounds(index)
+        opacity = _float(store.attr(index, "opacity"), 1.0)
+        if opacity <= 0 or (parent != -1 and self.transparent[parent]):
+            self.transparent[index] = 1
+            return
+        if bounds is None or bounds.right <= bounds.left or bounds.bottom <= bounds.top:
+            return
+        self.visible[index] = 1
+        self.opaque[index] = opacity >= 1 and _is_opaque_color(store.attr(index, "backgroundColor"))
+        for cell in self._cells(bounds.left, bounds.top, bounds.right, bounds.bottom):
+            self._grid[cell].append(index)
+
+    def _cells(self, left: int, top: int, right: int, bottom: int):
+        size = self.cell_size
+        for cx in range(left // size, (right - 1) // size + 1):
+            for cy in range(top // size, (bottom - 1) // size + 1):
+                yield cx, cy
+
+    def _contains(self, index: int, x: int, y: int) -> bool:
+        left, top, right, bottom = self.store.bounds[4 * index:4 * index + 4]
+        return left <= x < right and top <= y < bottom
+
+    def _related(self, a: int, b: int) -> bool:
+        """
+        True if one node is an ancestor of the other.
+        """
+        return a <= b <= self.subtree_end[a] or b <= a <= self.subtree_end[b]
+
+    def all_at(self, x: int, y: int) -> List[int]:
+        """
+        Visible nodes containing the point, topmost first.
+        """
+        cell = (x // self.cell_size, y // self.cell_size)
+        return [i for i in self._grid.get(cell, ()) if self._contains(i, x, y)]
+
+    def at(self, x: int, y: int) -> Optional[int]:
+        """
+        The topmost visible node at the point, None if there is none.
+        """
+        cell = (x // self.cell_size, y // self.cell_size)
+        for index in self._grid.get(cell, ()):
+            if self._contains(index, x, y):
+                return index
+        return None
+
+    def in_rect(self, left: int, top: int, right: int, bottom: int,
+                contained: bool = False) -> List[int]:
+        """
+        Visible nodes intersecting (or fully inside, if `contained`) the rectangle.
+        """
+        result = set()
+        for cell in self._cells(left, top, right, bottom):
+            for index in self._grid.get(cell, ()):
+                l, t, r, b = self.store.bounds[4 * index:4 * index + 4]
+                if contained:
+                    hit = left <= l and top <= t and r <= right and b <= bottom
+                else:
+                    hit = l < right and left < r and t < bottom and top < b
+                if hit:
+                    result.add(index)
+        return sorted(result)
+
+    @staticmethod
+    def has_opaque_nodes(store: NodeStore) -> bool:
+        """
+        Cheap check on the interned colors whether anything can occlude at all.
+        """
+        column = store.columns.get("backgroundColor", ())
+        return any(_is_opaque_color(store.strings[i]) for i in set(column))
+
+    def is_occluded(self, index: int) -> bool:
+        left, top, right, bottom = self.store.bounds[4 * index:4 * index + 4]
+        # an occluder covering the node must cover its top-left corner
+        cell = (left // self.cell_size, top // self.cell_size)
+        for other in self._grid.get(cell, ()):
+            if (self.opaque[other] and self.rank[other] > self.rank[index]
+                    and self.window[other] == self.window[index] and not self._related(index, other)):
+                l, t, r, b = self.store.bounds[4 * other:4 * other + 4]
+                if l <= left and t <= top and right <= r and bottom <= b:
+                    return True
+        return False
+
+    def occluded(self) -> Set[int]:
+        """
+        All nodes fully covered by another node, computed once.
+        """
+        if self._occluded is None:
+            self._occluded = {i for i in range(len(self.store)) if self.is_occluded(i)}
+        return self._occluded
@@ -5,18 +5,339 @@
     启动给定的 package / 获取所有的 packages
 """
 
+import heapq
+import itertools
 import shlex
 import subprocess
+import uuid
 import asyncio
-from .execption import HdcError
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+from . import logger
+from .config import SHELL_MODE, COMMAND_TIMEOUT, DEVICE_CONCURRENCY, COALESCE_WINDOW, COALESCE_MAX_BATCH
+from .execption import HdcError, SessionSpawnError
+from .session import get_session
+from .client import get_client
+from .hdc import Device, get_device, resolve_default
 
-async def _execute_command(cmd: str, timeout: int = None) -> tuple[bool, str]:
+T = TypeVar("T")
+
+_HDC = "hdc "
+_HDC_SHELL = "hdc shell "
+
+# scheduling priorities, lower runs first
+PRIORITY_INTERACTIVE = 0    # UI input and other commands changing the device
+PRIORITY_DEFAULT = 1        # queries made on behalf of a tool call
+PRIORITY_BACKGROUND = 2     # polling, e.g. background screen recording
+
+# shell commands that only read state: they run in parallel and identical
+# ones in flight share one execution; anything else is treated as mutating
+READ_ONLY_COMMANDS = ("bm dump", "aa dump", "hidumper", "param get", "cat ", "ls ", "base64 ")
+
+
+def _is_read_only(cmd: str) -> bool:
+    if cmd.startswith(_HDC_SHELL):
+        return cmd[len(_HDC_SHELL):].lstrip().startswith(READ_ONLY_COMMANDS)
+    return cmd.startswith(("hdc list ", "hdc file recv "))
+
+
+class DeviceScheduler:
+    """
+    Run the commands of one device in `max_parallel` slots.
+
+    Waiting commands start by priority, then in arrival order. Mutating
+    commands run one at a time and keep their order, and nothing else starts
+    while one runs, so a read issued after an action sees its effect.
+    Read-only commands share the slots, and a read-only command identical to
+    one queued or running since the last mutating command waits for that
+    execution instead of running again.
+    """
+
+    def __init__(self, max_parallel: int = DEVICE_CONCURRENCY):
+        self.max_parallel = max(1, max_parallel)
+        self._free_slots = list(range(self.max_parallel - 1, -1, -1))
+        self._writer_busy = False
+        self._waiting: List[Tuple[int, int, bool, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"executed": 0, "deduplicated": 0, "max_waiting": 0}
+
+    def _wake(self):
+        while self._waiting:
+            priority, _, mutating, waiter = self._waiting[0]
+            if waiter.done():
+                # the waiter was cancelled
+                heapq.heappop(self._waiting)
+                continue
+            if not self._free_slots or self._writer_busy:
+                return
+            heapq.heappop(self._waiting)
+            if mutating:
+                self._writer_busy = True
+            waiter.set_result(self._free_slots.pop())
+
+    def _release(self, slot: int, mutating: bool):
+        self._free_slots.append(slot)
+        if mutating:
+            self._writer_busy = False
+        self._wake()
+
+    async def _run(self, run: Callable[[int], Awaitable[T]], mutating: bool, priority: int) -> T:
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._order), mutating, waiter))
+        self.stats["max_waiting"] = max(self.stats["max_waiting"], len(self._waiting))
+        self._wake()
+        try:
+            slot = await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was granted in the meantime
+                self._release(waiter.result(), mutating)
+            raise
+        try:
+            self.stats["executed"] += 1
+            return await run(slot)
+        finally:
+            self._release(slot, mutating)
+
+    async def submit(self, key: str, run: Callable[[int], Awaitable[T]],
+                     read_only: bool = False, priority: int = None) -> T:
+        """
+        Run `run(slot)` once a slot is free. `key` identifies identical
+        read-only commands.
+        """
+        if priority is None:
+            priority = PRIORITY_DEFAULT if read_only else PRIORITY_INTERACTIVE
+        if not read_only:
+            # reads started before this command must not answer later ones
+            self._inflight.clear()
+            return await self._run(run, True, priority)
+        shared = self._inflight.get(key)
+        if shared is not None:
+            self.stats["deduplicated"] += 1
+        else:
+            shared = self._inflight[key] = asyncio.ensure_future(self._run(run, False, priority))
+
+            def _forget(future: asyncio.Future):
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+            shared.add_done_callback(_forget)
+        # a cancelled caller must not cancel the execution others wait for
+        return await asyncio.shield(shared)
+
+
+_schedulers: Dict[Optional[str], DeviceScheduler] = {}
+
+
+def get_scheduler(device: str = None) -> DeviceScheduler:
+    serial = get_device(device).serial
+    if serial not in _schedulers:
+        _schedulers[serial] = DeviceScheduler()
+    return _schedulers[serial]
+
+
+@dataclass
+class _QueuedShell:
+    cmd: str
+    timeout: float
+    priority: int
+    future: asyncio.Future
+
+
+def _build_batch(commands: List[str], timeouts: List[float], token: str) -> str:
+    """
+    One script running `commands` side by side, each in a background
+    subshell killed by a watchdog after its own timeout (the watchdogs keep
+    off stdout, which would hold the channel open), then printing the
+    output of each framed with its index and exit code, followed by its
+    stderr. The markers are built from two quoted halves so an echo of the
+    script never matches them.
+    """
+    directory = f"/data/local/tmp/.hdc_batch_{token}"
+    parts = [f"mkdir -p {directory}"]
+    for index, (command, timeout) in enumerate(zip(commands, timeouts)):
+        out, err = f"{directory}/{index}.out", f"{directory}/{index}.err"
+        parts.append(f"( {command}\n) </dev/null >{out} 2>{err} & __p{index}=$!")
+        parts.append(f"( sleep {timeout:g} && kill -9 $__p{index} && "
+                     f"echo 'Command timed out after {timeout:g} seconds' >{err} ) >/dev/null 2>&1 & __w{index}=$!")
+    for index in range(len(commands)):
+        parts.append(
+            f"wait $__p{index}; __rc=$?; kill $__w{index} 2>/dev/null; "
+            f"printf '\\n%s %d\\n' \"HDCB\"\"{token}\" {index}; cat {directory}/{index}.out; "
+            f"printf '\\n%s %d %d\\n' \"HDCE\"\"{token}\" {index} $__rc; cat {directory}/{index}.err"
+        )
+    parts.append(f"rm -rf {directory}")
+    return "\n".join(parts)
+
+
+def _split_batch(output: str, token: str, count: int) -> List[Optional[tuple[bool, str]]]:
+    """
+    The (success, output or error) of each command of a batch, None for
+    commands whose frame is missing.
+    """
+    results: List[Optional[tuple[bool, str]]] = [None] * count
+    begin, end = f"\nHDCB{token} ", f"\nHDCE{token} "
+    for frame in ("\n" + output.replace("\r\n", "\n")).split(begin)[1:]:
+        header, _, body = frame.partition("\n")
+        stop = body.find(end)
+        if stop == -1 or not header.strip().isdigit():
+            continue
+        index = int(header)
+        status, _, error = body[stop + len(end):].partition("\n")
+        exit_code = int(status.split()[1])
+        text = body[:stop]
+        if 0 <= index < count:
+            results[index] = (True, text) if exit_code == 0 else (False, error.rstrip("\n") or text)
+    return results
+
+
+class ShellCoalescer:
+    """
+    Collect the read-only shell commands sent to one device within `window`
+    seconds and run them as a single `hdc shell` invocation, at most
+    `max_batch` at a time. The commands of a batch run side by side, each
+    under its own timeout, and each caller gets its own output and exit
+    status back. An identical read-only command queued or running since the
+    last mutating command is shared instead of queued again. Mutating commands are never merged, so
+    an action does not wait for queries sent along with it.
+    """
+
+    def __init__(self, target: Device, scheduler: DeviceScheduler,
+                 window: float = COALESCE_WINDOW, max_batch: int = COALESCE_MAX_BATCH):
+        self.target = target
+        self.scheduler = scheduler
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._queue: List[_QueuedShell] = []
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.stats = {"commands": 0, "deduplicated": 0, "invocations": 0,
+                      "batches": 0, "batched_commands": 0, "largest_batch": 0}
+
+    async def submit(self, cmd: str, timeout: float, read_only: bool, priority: int = None) -> tuple[bool, str]:
+        self.stats["commands"] += 1
+        if priority is None:
+            priority = PRIORITY_DEFAULT if read_only else PRIORITY_INTERACTIVE
+        if not read_only:
+            # reads queued or running before this command must not answer later ones
+            self._inflight.clear()
+            self.stats["invocations"] += 1
+            return await self.scheduler.submit(
+                _HDC_SHELL + cmd, lambda slot: _execute_shell(cmd, timeout, self.target, slot),
+                read_only=False, priority=priority)
+        if cmd in self._inflight:
+            self.stats["deduplicated"] += 1
+            return await asyncio.shield(self._inflight[cmd])
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[cmd] = future
+
+        def _forget(done: asyncio.Future):
+            if self._inflight.get(cmd) is done:
+                del self._inflight[cmd]
+
+        future.add_done_callback(_forget)
+        self._queue.append(_QueuedShell(cmd, timeout, priority, future))
+        if len(self._queue) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        # a cancelled caller must not cancel the execution others wait for
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._queue = self._queue, []
+        if batch:
+            task = asyncio.ensure_future(self._execute(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, batch: List[_QueuedShell]):
+        self.stats["invocations"] += 1
+        try:
+            if len(batch) == 1:
+                item = batch[0]
+                results = [await self.scheduler.submit(
+                    _HDC_SHELL + item.cmd,
+                    lambda slot: _execute_shell(item.cmd, item.timeout, self.target, slot),
+                    read_only=True, priority=item.priority)]
+            else:
+                self.stats["batches"] += 1
+                self.stats["batched_commands"] += len(batch)
+                self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+                token = uuid.uuid4().hex[:16]
+                script = _build_batch([item.cmd for item in batch], [item.timeout for item in batch], token)
+                # the device enforces the timeout of each command, allow for the transfer
+                timeout = max(item.timeout for item in batch) + COMMAND_TIMEOUT
+                success, output = await self.scheduler.submit(
+                    script, lambda slot: _execute_shell(script, timeout, self.target, slot),
+                    read_only=True, priority=min(item.priority for item in batch))
+                results = _split_batch(output, token, len(batch))
+                # commands that did not report back share the failure of the batch
+                results = [result or (False, output if not success else "batched command did not finish")
+                           for result in results]
+        except BaseException as e:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            raise
+        for item, result in zip(batch, results):
+            if not item.future.done():
+                item.future.set_result(result)
+
+
+_coalescers: Dict[Optional[str], ShellCoalescer] = {}
+
+
+def get_coalescer(device: str = None) -> ShellCoalescer:
+    serial = get_device(device).serial
+    if serial not in _coalescers:
+        _coalescers[serial] = ShellCoalescer(get_device(device), get_scheduler(device))
+    return _coalescers[serial]
+
+
+async def get_command_stats(device: str = None) -> str:
+    """
+    Counters of the command scheduler and the shell command batching of a
+    device, e.g. how many commands were shared or merged into one invocation.
+    Args:
+        device: serial from `list_devices`, omit it for the only connected device
+    """
+    lines = ["scheduler: " + ", ".join(f"{k}={v}" for k, v in get_scheduler(device).stats.items())]
+    if COALESCE_WINDOW > 0:
+        coalescer = get_coalescer(device)
+        lines.append(f"batching (window {coalescer.window * 1000:g} ms, max {coalescer.max_batch}): "
+                     + ", ".join(f"{k}={v}" for k, v in coalescer.stats.items()))
+    else:
+        lines.append("batching: off")
+    return "\n".join(lines)
+
+
+async def _execute_command(cmd: str, timeout: int = None, device: str = None,
+                           read_only: bool = None, priority: int = None) -> tuple[bool, str]:
     """Run a shell command and return success status and output.
 
+    `hdc shell ...` commands are sent to the persistent shell session unless
+    `HDC_SHELL_MODE` is set to "spawn" or "native". `hdc ...` commands are
+    addressed to the given device and go through its scheduler; shell
+    commands arriving together are merged into one invocation when
+    `HDC_COALESCE_WINDOW` is set.
+
     Args:
         cmd (str): Shell command to execute.
         timeout (int, optional): Command execution timeout in seconds.
                                 If None, uses the default from config.
+        device (str, optional): Serial of the target device, None for the
+                                only connected device.
+        read_only (bool, optional): Whether the command leaves the device
+                                unchanged, guessed from the command if None.
+        priority (int, optional): One of the PRIORITY_* constants, by default
+                                interactive for mutating commands.
 
     Returns:
         tuple[bool, str]: A tuple containing:
@@ -28,8 +349,62 @@ async def _execute_command(cmd: str, timeout: int = None) -> tuple[bool, str]:
         cmd: str = ' '.join(list(map(shlex.quote, cmd)))
     
     if timeout is None:
-        timeout = 10
-        
+        timeout = COMMAND_TIMEOUT
+
+    if not cmd.startswith(_HDC):
+        return await _spawn_command(cmd, timeout)
+    if not device:
+        await resolve_default()
+    target = get_device(device)
+    if read_only is None:
+        read_only = _is_read_only(cmd)
+    if cmd.startswith(_HDC_SHELL) and COALESCE_WINDOW > 0:
+        return await get_coalescer(device).submit(cmd[len(_HDC_SHELL):], timeout, read_only, priority)
+
+    async def _run(slot: int) -> tuple[bool, str]:
+        if cmd.startswith(_HDC_SHELL):
+            return await _execute_shell(cmd[len(_HDC_SHELL):], timeout, target, slot)
+        return await _spawn_command(f"{target.prefix} {cmd[len(_HDC):]}", timeout)
+
+    return await get_scheduler(device).submit(cmd, _run, read_only=read_only, priority=priority)
+
+
+async def _execute_shell(cmd: str, timeout: float, target: Device, slot: int = 0) -> tuple[bool, str]:
+    """
+    Run `cmd` on the device shell, through the hdc server socket, the session
+    or a fresh `hdc` process depending on `HDC_SHELL_MODE`.
+    """
+    if SHELL_MODE == "native":
+        try:
+            result = await get_client(target.serial or "").shell(cmd, timeout=timeout)
+        except asyncio.TimeoutError:
+            return False, f"Command timed out after {timeout} seconds"
+        except (OSError, HdcError) as e:
+            return False, str(e)
+        if result.exit_code == 0:
+            return True, result.output
+        return False, result.error or result.output
+    if SHELL_MODE == "session":
+        try:
+            result = await get_session(target.prefix, slot).execute(cmd, timeout=timeout)
+        except asyncio.TimeoutError:
+            return False, f"Command timed out after {timeout} seconds"
+        except SessionSpawnError as e:
+            logger.warning(f"shell session failed, fallback to spawn mode: {e}")
+        except Exception as e:
+            # the script may have run already, running it again could repeat its effect
+            return False, f"shell session failed: {e}"
+        else:
+            if result.exit_code == 0:
+                return True, result.output
+            return False, result.error or result.output
+    return await _spawn_command(f"{target.prefix} shell {shlex.quote(cmd)}", timeout)
+
+
+async def _spawn_command(cmd: str, timeout: float) -> tuple[bool, str]:
+    """
+    Run `cmd` in a new host shell process.
+    """
     try:
         process = await asyncio.create_subprocess_shell(
             cmd,
@@ -58,13 +433,13 @@ async def _execute_command(cmd: str, timeout: int = None) -> tuple[bool, str]:
     except Exception as e:
         return False, str(e)
     
-async def shell(cmd: str) -> str:
+async def shell(cmd: str, device: str = None) -> str:
     # ensure the command is wrapped in double quotes
     # if cmd[0] != '\"':
     #     cmd = "\"" + cmd
     # if cmd[-1] != '\"':
     #     cmd += '\"'
-    success, result = await _execute_command(f"hdc shell {cmd}")
+    success, result = await _execute_command(f"hdc shell {cmd}", device=device)
     if not success:
         raise HdcError("HDC shell error", f"{cmd}\n{result}")
     return result
@@ -75,8 +450,10 @@ async def shell(cmd: str) -> str:
 #         raise HdcError("HDC send file error", result.error)
 #     return result
 
-async def recv_file(rpath: str, lpath: str):
-    success, result = await _execute_command(f"hdc file recv {rpath} {lpath}")
+async def recv_file(rpath: str, lpath: str, device: str = None):
+    if SHELL_MODE == "native":
+        return await get_client(device or "").recv_file(rpath, lpath, timeout=COMMAND_TIMEOUT)
+    success, result = await _execute_command(f"hdc file recv {rpath} {lpath}", device=device)
     if success:
         return result
 
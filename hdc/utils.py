@@ -1,27 +1,10 @@
-import time
 import socket
 import re
-from functools import wraps
 from typing import Union
 
 from .proto import Bounds
 
 
-def delay(func):
-    """
-    After each UI operation, it is necessary to wait for a while to ensure the stability of the UI,
-    so as not to affect the next UI operation.
-    """
-    DELAY_TIME = 0.6
-
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        result = func(*args, **kwargs)
-        time.sleep(DELAY_TIME)
-        return result
-    return wrapper
-
-
 class FreePort:
     def __init__(self):
         self._start = 10000
@@ -5,17 +5,170 @@
     输入文本
     获取屏幕状态，唤醒/熄灭屏幕
 """
+from . import logger
+from .config import (UI_BACKEND, HIERARCHY_CACHE_MAX_AGE, COMMAND_TIMEOUT, INPUT_CHUNK_SIZE,
+                     TYPING_SECONDS_PER_CHAR)
 from .system import _execute_command
-from .Component import ComponentNode
-from .proto import KeyCode
+from .capture import get_capture
+from .driver import get_driver
+from .execption import HdcError
+from .hdc import device_key
+from .Component import NodeStore
+from .hierarchy import iter_nodes, loads
+from .layout_diff import LayoutDelta, diff_elements
+from .selector import LayoutIndex, Selector
+from .settle import forget_capture, settle, settled_capture
+from .spatial import SpatialIndex
+from .proto import KeyCode, ElementInfo
+import inspect
 import re
+import shlex
+import time
+from dataclasses import dataclass
+from functools import wraps
+from typing import Dict, List, Optional
 
 
-async def click(center) -> bool:
+@dataclass
+class LayoutCacheEntry:
+    epoch: int              # interaction epoch the dump was started in
+    timestamp: float        # time.monotonic() when the dump was started
+    raw: str                # raw layout dump text
+    nodes: Optional[NodeStore] = None   # parsed nodes, built on first use
+    elements: Optional[List[ElementInfo]] = None    # elements listed by `get_uilayout`
+    formatted: Optional[str] = None     # memoized `get_uilayout` output
+    index: Optional[LayoutIndex] = None     # selector indexes, built on first query
+    spatial: Optional[SpatialIndex] = None  # hit-testing grid, built on first use
+
+
+# interaction epoch and cached layout per device, `None` is the default device
+_epochs: Dict[Optional[str], int] = {}
+_layout_cache: Dict[Optional[str], LayoutCacheEntry] = {}
+# elements returned by the last `get_uilayout`, the base of delta mode
+_last_elements: Dict[Optional[str], List[ElementInfo]] = {}
+
+# above this share of changed elements a delta is no cheaper than a full list
+DELTA_MAX_CHANGE_RATIO = 0.5
+
+
+def interaction_epoch(device: str = None) -> int:
+    return _epochs.get(device_key(device), 0)
+
+
+def bump_epoch(device: str = None):
+    """
+    Mark that the UI may have changed, invalidating the cached layout.
+    """
+    _epochs[device_key(device)] = interaction_epoch(device) + 1
+    forget_capture(device)
+
+
+def _failed(result) -> bool:
+    return result is False or (isinstance(result, str) and result.startswith(("[Fail]", "Failed")))
+
+
+def interaction(func):
+    """
+    Decorator for tools that change the UI: bump the interaction epoch of
+    the target device once the action has been sent, even if it failed half
+    way, then wait for the UI to settle. When settle detection is enabled
+    the result is text reporting the settle time.
+    """
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        device = signature.bind_partial(*args, **kwargs).arguments.get("device")
+        try:
+            result = await func(*args, **kwargs)
+        finally:
+            bump_epoch(device)
+        if _failed(result):
+            return result
+        return await _settle_after(func.__name__, result, device)
+    return wrapper
+
+
+async def _settle_after(name: str, result, device: str = None):
+    epoch = interaction_epoch(device)
+    settled = await settle(device)
+    if interaction_epoch(device) != epoch:
+        # another action ran meanwhile, what settle saw is already stale
+        forget_capture(device)
+    if settled is not None:
+        logger.debug(f"{name}: {settled}")
+        # bool and None results of plain actions become text to carry it
+        text = result if isinstance(result, str) else f"[Success] {name}"
+        result = f"{text}\n[Settle] {settled}"
+    return result
+
+
+def layout_nodes(layout: LayoutCacheEntry) -> NodeStore:
+    if layout.nodes is None:
+        layout.nodes = NodeStore.from_nodes(iter_nodes(layout.raw))
+    return layout.nodes
+
+
+def layout_spatial(layout: LayoutCacheEntry) -> SpatialIndex:
+    if layout.spatial is None:
+        layout.spatial = SpatialIndex(layout_nodes(layout))
+    return layout.spatial
+
+
+def _cached_layout(device: str = None) -> Optional[LayoutCacheEntry]:
+    entry = _layout_cache.get(device_key(device))
+    if entry is None or entry.epoch != interaction_epoch(device):
+        return None
+    if HIERARCHY_CACHE_MAX_AGE and time.monotonic() - entry.timestamp > HIERARCHY_CACHE_MAX_AGE:
+        return None
+    return entry
+
+
+async def get_layout(device: str = None) -> LayoutCacheEntry:
+    """
+    Return the layout dump of the current screen, reusing the cached dump
+    if no interaction happened since it was taken.
+    """
+    entry = _cached_layout(device)
+    if entry is not None:
+        return entry
+    # take the epoch before dumping, an action racing with the dump makes it stale
+    epoch, timestamp = interaction_epoch(device), time.monotonic()
+    raw = settled_capture(device, "layout") or await dump_hierarchy(device)
+    entry = LayoutCacheEntry(epoch=epoch, timestamp=timestamp, raw=raw)
+    _layout_cache[device_key(device)] = entry
+    return entry
+
+
+async def _rpc(action: str, *args, device: str = None, force: bool = False) -> bool:
+    """
+    Send the action through the uitest agent when the rpc backend is enabled,
+    or `force`d. Returns False if the caller should fall back to `uitest uiInput`.
+    """
+    if UI_BACKEND != "rpc" and not force:
+        return False
+    try:
+        await getattr(get_driver(device), action)(*args)
+        return True
+    except (OSError, HdcError) as e:
+        logger.warning(f"uitest agent {action} failed, fallback to uiInput: {e}")
+        return False
+
+
+async def _click(x: int, y: int, device: str = None) -> bool:
+    if await _rpc("click", x, y, device=device):
+        return True
+    success, _ = await _execute_command(f"hdc shell uitest uiInput click {x} {y}", device=device)
+    return success
+
+
+@interaction
+async def click(center, device: str = None) -> bool:
     """
     click the given coordinate
     Args:
         center: a string like "(x, y)", sample: "(227, 168)"
+        device: serial from `list_devices`, omit it for the only connected device
     """
     import re
     matches = re.findall(r"(\d+)\s*,\s*(\d+)", center)
@@ -23,15 +176,22 @@ async def click(center) -> bool:
         return "[Fail] The input should be given like `(277, 168)` : click x=277, y=168"
     
     x, y = map(int, matches[0])
-    success, _ = await _execute_command(f"hdc shell uitest uiInput click {x} {y}")
+    # check the target against the current layout if it is already known,
+    # the layout may miss what is there, so tap anyway
+    layout = _cached_layout(device)
+    if layout is not None and layout_spatial(layout).at(x, y) is None:
+        success = await _click(x, y, device)
+        return (f"[{'Success' if success else 'Fail'}] click ({x}, {y}); "
+                f"warning: the last layout has no element there")
+    return await _click(x, y, device)
 
-    return success
-
-async def long_click(center) -> bool:
+@interaction
+async def long_click(center, device: str = None) -> bool:
     """
     long click the given coordinate
     Args:
         center: a string like "(x, y)", sample: "(227, 168)"
+        device: serial from `list_devices`, omit it for the only connected device
     """
     import re
     matches = re.findall(r"(\d+)\s*,\s*(\d+)", center)
@@ -39,18 +199,30 @@ async def long_click(center) -> bool:
         return "[Fail] The input should be given like `(277, 168)` : click x=277, y=168"
     
     x, y = map(int, matches[0])
-    success, _ = await _execute_command(f"hdc shell uitest uiInput longClick {x} {y}")
+    if await _rpc("long_click", x, y, device=device):
+        return True
+    success, _ = await _execute_command(f"hdc shell uitest uiInput longClick {x} {y}", device=device)
     return success
 
-async def swipe(x1, y1, x2, y2, speed=1000):
-    await _execute_command(f"hdc shell uitest uiInput swipe {x1} {y1} {x2} {y2} {speed}")
+@interaction
+async def swipe(x1, y1, x2, y2, speed=1000, device: str = None):
+    if await _rpc("swipe", x1, y1, x2, y2, speed, device=device):
+        return
+    await _execute_command(f"hdc shell uitest uiInput swipe {x1} {y1} {x2} {y2} {speed}", device=device)
+
+def _chunks(text: str, size: int) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
 
-async def input_text(center, text) -> str:
+@interaction
+async def input_text(center, text, enter: bool = True, device: str = None) -> str:
     """
     input text to the given coordinate
     Args:
         center: a string like "(x, y)", sample: "(227, 168)"
-        text: the text to input
+        text: the text to input, any length and characters
+        enter: press ENTER after the text
+        device: serial from `list_devices`, omit it for the only connected device
     """
     import re
     matches = re.findall(r"(\d+)\s*,\s*(\d+)", center)
@@ -58,118 +230,259 @@ async def input_text(center, text) -> str:
         return "[Fail] The input should be given like `(277, 168) hello world`"
 
     x, y = map(int, matches[0])
-    await _execute_command(f"hdc shell uitest uiInput inputText {x} {y} {text}")
-    await _execute_command(f"hdc shell uitest uiInput keyEvent {KeyCode.ENTER.value}")
+    # long text goes to the uitest agent in one call when it is reachable,
+    # on the shell command line it needs many chunks
+    bulk = UI_BACKEND == "rpc" or len(text) > INPUT_CHUNK_SIZE
+    typed = bulk and await _rpc("input_text", x, y, text, device=device, force=True)
+    commands = []
+    if not typed:
+        # the first chunk focuses the field, the others are typed at the caret
+        first, *rest = _chunks(text, INPUT_CHUNK_SIZE)
+        commands.append(f"uitest uiInput inputText {x} {y} {shlex.quote(first)}")
+        commands.extend(f"uitest uiInput text {shlex.quote(chunk)}" for chunk in rest)
+    # ENTER joins the shell invocation if there is one anyway
+    if enter and (commands or not await _rpc("press_key", KeyCode.ENTER.value, device=device)):
+        commands.append(f"uitest uiInput keyEvent {KeyCode.ENTER.value}")
+    if commands:
+        timeout = COMMAND_TIMEOUT + len(text) * TYPING_SECONDS_PER_CHAR
+        success, output = await _execute_command("hdc shell " + " && ".join(commands),
+                                                 timeout=timeout, device=device)
+        if not success:
+            return f"[Fail] {output}"
+    return f"[Success] typed {len(text)} characters" + (" and pressed ENTER" if enter else "")
 
 
-async def screen_state() -> str:
+async def screen_state(device: str = None) -> str:
     """
     ["INACTIVE", "SLEEP, AWAKE"]
     """
-    success, data = await _execute_command("hdc shell hidumper -s PowerManagerService -a -s")
+    success, data = await _execute_command("hdc shell hidumper -s PowerManagerService -a -s", device=device)
     if success:
         pattern = r"Current State:\s*(\w+)"
         match = re.search(pattern, data)
 
         return match.group(1) if match else None
 
-async def wakeup():
+async def wakeup(device: str = None):
     """
     wake up the phone
     """
-    success, result = _execute_command("hdc shell power-shell wakeup")
+    success, result = await _execute_command("hdc shell power-shell wakeup", device=device)
     if success:
         return result
 
-async def dump_hierarchy():
+async def dump_hierarchy(device: str = None) -> str:
+    """
+    dump the hierachy and return the raw json text.
+    The layout is dumped to a per-capture file on the device and printed to
+    stdout in a single shell invocation, so concurrent dumps never share a
+    file and nothing is written on the host.
+    """
+    return await get_capture(device).layout()
+
+def format_element(element: ElementInfo) -> str:
     """
-    dump the hierachy and save it to `tmp.json` in the local working dir
+    format a single element for `get_uilayout`
     """
-    _tmp_path = f"/data/local/tmp/hierarchy_tmp.json"
-    await _execute_command(f"hdc shell uitest dumpLayout -p {_tmp_path}")
-    await _execute_command(f"hdc file recv {_tmp_path} ./tmp.json")
+    clickable = element.isClickable
+    editable = element.type in ["Text", "TextInput", "SearchField"] and clickable
+    key = element.key
+
+    element_infos = []
+    element_type = "Element Type: "
+    if not any([clickable, editable, key]):
+        element_type += "Plaintext"
+    else:
+        element_type += "Clickable " if clickable or key else ""
+        element_type += "Editable " if editable or key else ""
+    element_infos.append(element_type)
+
+    if key:
+        element_infos.append(f"Key: {key}")
+    if element.text:
+        element_infos.append(f"Text: {element.text}")
+    if element.description:
+        element_infos.append(f"Description: {element.description}")
+    if element.boundsCenter:
+        element_infos.append(f"Center: ({element.boundsCenter.x}, {element.boundsCenter.y})")
+    if element.bounds:
+        b = element.bounds
+        element_infos.append(f"Bounds: [{b.left},{b.top}][{b.right},{b.bottom}]")
+    return "\n    ".join(element_infos)
+
+
+def _format_delta(delta: LayoutDelta) -> str:
+    def _short(element: ElementInfo) -> str:
+        return element.text or element.description or element.key
 
-async def get_uilayout() -> str:
+    def _center(element: ElementInfo) -> str:
+        c = element.boundsCenter
+        return f"({c.x}, {c.y})" if c else "(?)"
+
+    sections = [
+        f"[Delta] {len(delta.added)} added, {len(delta.removed)} removed, "
+        f"{len(delta.moved)} moved, {len(delta.changed)} changed, "
+        f"{delta.unchanged} unchanged since the last get_uilayout"
+    ]
+    if delta.shift:
+        dx, dy = delta.shift
+        sections.append(f"Shifted: {delta.shifted} other elements moved together by ({dx}, {dy})")
+    if delta.added:
+        sections.append("Added:\n" + "\n\n".join(format_element(e) for e in delta.added))
+    if delta.removed:
+        sections.append("Removed:\n" + "\n".join(
+            f"    {_short(e)} at {_center(e)}" for e in delta.removed))
+    if delta.moved:
+        sections.append("Moved:\n" + "\n".join(
+            f"    {_short(new)}: {_center(old)} -> {_center(new)}" for old, new in delta.moved))
+    if delta.changed:
+        sections.append("Changed:\n" + "\n\n".join(format_element(new) for _, new in delta.changed))
+    return "\n\n".join(sections)
+
+
+async def get_uilayout(delta: bool = False, device: str = None) -> str:
     """
     Retrieves information about clickable elements in the current UI.
     Returns a formatted string containing details about each clickable element,
     including its text, content description, bounds, and center coordinates.
 
+    Args:
+        delta: only return the elements added, removed, moved or changed since
+               the previous call. Falls back to the full list when there is no
+               previous call or most of the screen changed.
+        device: serial from `list_devices`, omit it for the only connected device
+
     Returns:
         str: A formatted list of clickable elements with their properties
     """
-    await dump_hierarchy()
+    layout = await get_layout(device)
+    if layout.elements is None:
+        nodes = layout_nodes(layout)
+        texts = nodes.columns.get("text", ())
+        descriptions = nodes.columns.get("description", ())
+        # elements fully hidden behind an opaque node are not worth listing
+        occluded = layout_spatial(layout).occluded() if SpatialIndex.has_opaque_nodes(nodes) else ()
+        layout.elements = [
+            nodes.element(i) for i in range(len(nodes))
+            if ((texts and texts[i]) or (descriptions and descriptions[i])) and i not in occluded
+        ]
 
-    import re
+    previous = _last_elements.get(device_key(device))
+    _last_elements[device_key(device)] = layout.elements
+    if delta and previous is not None:
+        changes = diff_elements(previous, layout.elements)
+        if changes.change_ratio() <= DELTA_MAX_CHANGE_RATIO:
+            return _format_delta(changes)
 
-    def calculate_center(bounds_str):
-        matches = re.findall(r"\[(\d+),(\d+)\]", bounds_str)
-        if len(matches) == 2:
-            x1, y1 = map(int, matches[0])
-            x2, y2 = map(int, matches[1])
-            center_x = (x1 + x2) // 2
-            center_y = (y1 + y2) // 2
-            return center_x, center_y
-        return None
+    if layout.formatted is None:
+        if not layout.elements:
+            layout.formatted = "No clickable elements found with text or description"
+        else:
+            layout.formatted = "\n\n".join(format_element(e) for e in layout.elements)
+    return layout.formatted
 
-    clickable_elements = []
-
-    def traverseTree(root):
-        """
-        traverse the tree to extract all layouts
-        """
-        node_info: ComponentNode = root["attributes"]
-        text = node_info["text"].strip()
-        desc = node_info["description"].strip()
-        bounds = node_info["bounds"].strip()
-        clickable = node_info["clickable"].strip() == "true"
-        editable = node_info["type"] in ["Text", "TextInput", "SearchField"] and clickable
-        key = node_info["key"].strip()
-        
-        if any([text, desc]):
-            element_infos = []
-            element_type = "Element Type: "
-            if not any([clickable, editable, key]):
-                element_type += "Plaintext"
-            else:
-                element_type += "Clickable " if clickable or key else ""
-                element_type += "Editable " if editable or key else ""
-            element_infos.append(element_type)
-
-            center = calculate_center(bounds) 
-            if key:
-                element_infos.append(f"Key: {key}")
-            if text:
-                element_infos.append(f"Text: {text}")
-            if desc:
-                element_infos.append(f"Description: {desc}")
-            if center:
-                element_infos.append(f"Center: ({center[0]}, {center[1]})")
-            element_infos.append(f"Bounds: {bounds}")
-
-            clickable_elements.append("\n    ".join(element_infos))
-        for child in root["children"]:
-            # skip the system status bar
-            if child["attributes"].get("bundleName", "") == "com.ohos.sceneboard":
-                continue
-            traverseTree(child)
-
-    root = get_hierachy_tree()
-    
-    traverseTree(root)
-    if not clickable_elements:
-        return "No clickable elements found with text or description"
+async def _select(text: str = None, text_regex: str = None, key: str = None, type: str = None,
+                  description: str = None, clickable: bool = None, scrollable: bool = None,
+                  ancestor_text: str = None, ancestor_key: str = None,
+                  ancestor_type: str = None, device: str = None) -> tuple[LayoutIndex, List[int]]:
+    ancestor = Selector(text=ancestor_text, key=ancestor_key, type=ancestor_type)
+    selector = Selector(text=text, text_regex=text_regex, key=key, type=type,
+                        description=description, clickable=clickable, scrollable=scrollable,
+                        ancestor=None if ancestor.is_empty() else ancestor)
+    if selector.is_empty():
+        raise ValueError("at least one condition is required")
+
+    layout = await get_layout(device)
+    if layout.index is None:
+        layout.index = LayoutIndex(layout_nodes(layout))
+    return layout.index, layout.index.find(selector)
+
+
+async def find_elements(text: str = None, text_regex: str = None, key: str = None, type: str = None,
+                        description: str = None, clickable: bool = None, scrollable: bool = None,
+                        ancestor_text: str = None, ancestor_key: str = None,
+                        ancestor_type: str = None, device: str = None) -> str:
+    """
+    Find elements in the current UI matching all the given conditions.
+    Args:
+        text: exact text of the element
+        text_regex: regular expression searched in the text
+        key: the element key
+        type: the component type, e.g. "Button", "TextInput"
+        description: exact content description
+        clickable: only (non-)clickable elements
+        scrollable: only (non-)scrollable elements
+        ancestor_text / ancestor_key / ancestor_type: conditions on any ancestor
+        device: serial from `list_devices`, omit it for the only connected device
+    Returns:
+        The matching elements numbered by their `index` for `click_element`
+    """
+    try:
+        layout_index, matches = await _select(text, text_regex, key, type, description, clickable,
+                                              scrollable, ancestor_text, ancestor_key, ancestor_type, device)
+    except (ValueError, re.error) as e:
+        return f"[Fail] {e}"
+    if not matches:
+        return "No element matches the given conditions"
+    return f"Found {len(matches)} elements\n\n" + "\n\n".join(
+        f"[{i}] " + format_element(layout_index.element(match)) for i, match in enumerate(matches)
+    )
+
+
+async def click_element(text: str = None, text_regex: str = None, key: str = None, type: str = None,
+                        description: str = None, clickable: bool = None, scrollable: bool = None,
+                        ancestor_text: str = None, ancestor_key: str = None,
+                        ancestor_type: str = None, index: int = 0, device: str = None) -> str:
+    """
+    Find an element like `find_elements` and click its center in one step.
+    Args:
+        index: which of the matching elements to click, 0 for the first one
+        device: serial from `list_devices`, omit it for the only connected device
+    """
+    try:
+        layout_index, matches = await _select(text, text_regex, key, type, description, clickable,
+                                              scrollable, ancestor_text, ancestor_key, ancestor_type, device)
+    except (ValueError, re.error) as e:
+        return f"[Fail] {e}"
+    if not matches:
+        return "[Fail] No element matches the given conditions"
+    if index >= len(matches):
+        return f"[Fail] {len(matches)} elements match the given conditions, no element #{index}"
+
+    element = layout_index.element(matches[index])
+    if element.boundsCenter is None:
+        return "[Fail] the element has no bounds"
+    x, y = element.boundsCenter.to_tuple()
+    try:
+        clicked = await _click(x, y, device)
+    finally:
+        bump_epoch(device)
+    if not clicked:
+        return f"[Fail] click ({x}, {y}) failed"
+    result = f"[Success] clicked {element.text or element.description or element.key or element.type} at ({x}, {y})"
+    return await _settle_after("click_element", result, device)
+
+
+async def wait_for_ui_settle(max_wait: float = 3.0, signal: str = "screen", device: str = None) -> str:
+    """
+    Wait until the UI stops changing, e.g. after an animation or a page load.
+    Args:
+        max_wait: seconds to wait at most
+        signal: "screen" to watch screenshots, "layout" to watch the component tree
+        device: serial from `list_devices`, omit it for the only connected device
+    Returns:
+        whether the UI settled and how long it took
+    """
+    if signal not in ("screen", "layout"):
+        return f"[Fail] unknown signal {signal}, use \"screen\" or \"layout\""
+    settled = await settle(device, max_wait=max_wait, signal=signal)
+    return str(settled) if settled is not None else "[Fail] the UI could not be watched, see the server log"
 
-    result = "\n\n".join(clickable_elements)
-    return result
 
-def get_hierachy_tree():
+def get_hierachy_tree(raw: str):
     """
-    parse the hierachy tree
+    parse the hierachy tree from the raw dump text
     """
-    import json
-    with open("tmp.json", "r", encoding="utf-8") as fp:
-        res = fp.read()
-        start = res.find("{")
-        root = json.loads(res[start:])
+    start = raw.find("{")
+    root = loads(raw[start:])
     return root
@@ -1,11 +1,32 @@
+from contextlib import asynccontextmanager
+
+from hdc.hdc import list_devices, resolve_default
+from hdc.system import get_command_stats
 from hdc.app_manager import list_app, launch_app, stop_app, current_app
-from hdc.window_manager import get_uilayout, click, long_click, swipe, input_text
-from hdc.media import get_screenshot, media_play_pause, volume_up, volume_down, volume_mute, media_next, media_previous
+from hdc.window_manager import get_uilayout, click, long_click, swipe, input_text, find_elements, click_element, wait_for_ui_settle
+from hdc.actions import run_actions, press_keys
+from hdc.gestures import swipe_path, fling, drag, pinch
+from hdc.media import get_screenshot, get_screen_hash, get_screen_regions, start_screen_recording, stop_screen_recording, wait_for_screen_frame, media_play_pause, volume_up, volume_down, volume_mute, media_next, media_previous
+from hdc.session import close_sessions
 from mcp.server.fastmcp import FastMCP
 
+
+@asynccontextmanager
+async def lifespan(server):
+    # know the only connected device before the first tool call
+    await resolve_default()
+    try:
+        yield
+    finally:
+        # end the shell sessions, removing their files from the device
+        await close_sessions()
+
+
 # Initialize MCP server
-mcp = FastMCP("harmonyos")
+mcp = FastMCP("harmonyos", lifespan=lifespan)
 
+mcp.tool()(list_devices)
+mcp.tool()(get_command_stats)
 mcp.tool()(list_app)
 mcp.tool()(launch_app)
 mcp.tool()(stop_app)
@@ -20,10 +41,24 @@ mcp.tool()(volume_mute)
 
 mcp.tool()(get_uilayout)
 mcp.tool()(get_screenshot)
+mcp.tool()(get_screen_hash)
+mcp.tool()(get_screen_regions)
+mcp.tool()(start_screen_recording)
+mcp.tool()(stop_screen_recording)
+mcp.tool()(wait_for_screen_frame)
 mcp.tool()(click)
 mcp.tool()(long_click)
 mcp.tool()(swipe)
+mcp.tool()(swipe_path)
+mcp.tool()(fling)
+mcp.tool()(drag)
+mcp.tool()(pinch)
 mcp.tool()(input_text)
+mcp.tool()(find_elements)
+mcp.tool()(click_element)
+mcp.tool()(wait_for_ui_settle)
+mcp.tool()(run_actions)
+mcp.tool()(press_keys)
 
 
 @mcp.prompt()